@@ -0,0 +1,171 @@
+"""Minimal stand-in for the userbot host, used to load modules offline.
+
+Modules import ``loader``, ``utils``, ``security`` and ``main`` from their
+parent package. This file registers a fake ``ftg`` package providing just
+enough of that surface, plus an in-memory database and a Telegram client
+stub, so benchmarks can drive module code without a network connection.
+Telethon itself (and each module's own requirements) must be installed.
+"""
+
+import asyncio
+import functools
+import importlib.util
+import shlex
+import sys
+import types
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+
+class Strings(dict):
+    """Callable strings mapping, like the one `loader.tds` installs"""
+
+    def __call__(self, key, _=None):
+        return self[key]
+
+
+class ModuleConfig(dict):
+    """Flat key/default/doc triples, like the host's `loader.ModuleConfig`"""
+
+    def __init__(self, *entries):
+        super().__init__()
+        for i in range(0, len(entries), 3):
+            self[entries[i]] = entries[i + 1]
+
+    def getdoc(self, key, _=None):
+        return key
+
+
+class Module:
+    """Base class for modules"""
+
+    strings = {}
+
+    def __new__(cls, *args, **kwargs):
+        self = super().__new__(cls)
+        self.strings = Strings(cls.strings)
+        return self
+
+
+def _identity(func):
+    return func
+
+
+class FakeDB(dict):
+    """In-memory database with the host's `get`/`set` interface"""
+
+    def get(self, owner, key, default=None):
+        return super().get(owner, {}).get(key, default)
+
+    def set(self, owner, key, value):
+        self.setdefault(owner, {})[key] = value
+        return True
+
+
+class FakeClient:
+    """Telegram client stub recording requests instead of sending them"""
+
+    def __init__(self, self_id: int = 1):
+        self._self_id = self_id
+        self._mb_entity_cache = {}
+        self.requests = []
+        self.deleted = []
+
+    async def __call__(self, request, *args, **kwargs):
+        self.requests.append(request)
+
+    async def delete_messages(self, entity, message_ids, **kwargs):
+        self.deleted.append((entity, message_ids))
+
+    async def send_message(self, entity, message="", **kwargs):
+        self.requests.append(("send_message", entity, message))
+
+    def add_event_handler(self, callback, event=None):
+        pass
+
+    def remove_event_handler(self, callback, event=None):
+        pass
+
+
+async def answer(message, response, **kwargs):
+    return await message.edit(response)
+
+
+async def run_sync(func, *args, **kwargs):
+    return await asyncio.get_event_loop().run_in_executor(
+        None, functools.partial(func, *args, **kwargs)
+    )
+
+
+def get_args_raw(message):
+    text = getattr(message, "message", message) or ""
+    return text.split(maxsplit=1)[1] if len(text.split(maxsplit=1)) > 1 else ""
+
+
+def get_args(message):
+    return shlex.split(get_args_raw(message))
+
+
+def escape_html(text):
+    return str(text).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+
+def _install_host():
+    if "ftg" in sys.modules:
+        return
+
+    package = types.ModuleType("ftg")
+    package.__path__ = []
+    modules = types.ModuleType("ftg.modules")
+    modules.__path__ = [str(REPO_DIR)]
+
+    loader = types.ModuleType("ftg.loader")
+    loader.Module = Module
+    loader.ModuleConfig = ModuleConfig
+    loader.tds = _identity
+    loader.owner = _identity
+    loader.unrestricted = _identity
+
+    utils = types.ModuleType("ftg.utils")
+    utils.answer = answer
+    utils.run_sync = run_sync
+    utils.get_args = get_args
+    utils.get_args_raw = get_args_raw
+    utils.escape_html = escape_html
+
+    security = types.ModuleType("ftg.security")
+    security.OWNER = 1
+    security.SUDO = 2
+
+    main = types.ModuleType("ftg.main")
+
+    for name, module in {
+        "loader": loader,
+        "utils": utils,
+        "security": security,
+        "main": main,
+    }.items():
+        setattr(package, name, module)
+        sys.modules[f"ftg.{name}"] = module
+
+    package.modules = modules
+    sys.modules["ftg"] = package
+    sys.modules["ftg.modules"] = modules
+
+
+def load_module(name: str, directory: Path = REPO_DIR) -> types.ModuleType:
+    """Import `<name>.py` from `directory` (repository root by default)"""
+    _install_host()
+
+    full_name = f"ftg.modules.{name}"
+    if full_name in sys.modules:
+        return sys.modules[full_name]
+
+    spec = importlib.util.spec_from_file_location(
+        full_name, Path(directory) / f"{name}.py"
+    )
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[full_name] = module
+    spec.loader.exec_module(module)
+    return module
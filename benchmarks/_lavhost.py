@@ -0,0 +1,160 @@
+"""Local stand-ins for api.lavhost.su and @lavHostBot.
+
+`MockLavHostAPI` is an aiohttp server answering `user/information` (with
+ETag support) and `user/check` like the real API does, with optional latency
+and injected faults. `FakeBotClient` answers `/token` conversations with the
+server's current token, so `LavHostMod` can run end to end without a network.
+"""
+
+import asyncio
+import hashlib
+import json
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+
+from aiohttp import web
+
+from _ftg import FakeClient
+
+
+class MockLavHostAPI:
+    """aiohttp server mimicking lavHost API"""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        reset_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.reset_rate = reset_rate
+        self.rng = random.Random(seed)
+
+        self.token_version = 0
+        self.requests = 0
+        self.statuses = Counter()
+        self.connections = set()
+        self.info = {
+            "username": "benchmark",
+            "type": "Premium",
+            "server": "f1",
+            "userbot": "Hikka",
+            "expires_date": (datetime.utcnow() + timedelta(days=30)).isoformat(),
+        }
+
+        self.app = web.Application()
+        self.app.router.add_get("/user/information", self.information)
+        self.app.router.add_get("/user/check", self.check)
+        self.runner = None
+
+    @property
+    def token(self) -> str:
+        return f"token-{self.token_version}"
+
+    def rotate_token(self):
+        """Revoke the current token, as if it has expired"""
+        self.token_version += 1
+
+    def reset_stats(self):
+        self.requests = 0
+        self.statuses.clear()
+        self.connections.clear()
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start server and return its base URL"""
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}"
+
+    async def close(self):
+        await self.runner.cleanup()
+
+    async def respond(self, request: web.Request, handler) -> web.StreamResponse:
+        """Account request, apply latency and faults, then call `handler`"""
+        self.requests += 1
+        self.connections.add(request.transport.get_extra_info("peername"))
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        roll = self.rng.random()
+        if roll < self.reset_rate:
+            self.statuses["reset"] += 1
+            request.transport.close()
+            raise asyncio.CancelledError
+        if roll < self.reset_rate + self.error_rate:
+            response = web.Response(status=503, text="Service Unavailable")
+        else:
+            response = handler()
+
+        self.statuses[response.status] += 1
+        return response
+
+    async def information(self, request: web.Request) -> web.StreamResponse:
+        def handler():
+            if request.headers.get("Authorization") != f"Bearer {self.token}":
+                return web.Response(status=401, text="Invalid token")
+
+            body = json.dumps(self.info)
+            etag = f'"{hashlib.md5(body.encode()).hexdigest()}"'
+            if request.headers.get("If-None-Match") == etag:
+                return web.Response(status=304, headers={"ETag": etag})
+            return web.json_response(text=body, headers={"ETag": etag})
+
+        return await self.respond(request, handler)
+
+    async def check(self, request: web.Request) -> web.StreamResponse:
+        def handler():
+            user_id = int(request.query["user_id"])
+            return web.json_response({"active_user": user_id % 2 == 0})
+
+        return await self.respond(request, handler)
+
+
+class _BotMessage:
+    def __init__(self, text: str = ""):
+        self.raw_text = text
+
+    async def delete(self):
+        pass
+
+
+class _Conversation:
+    def __init__(self, client: "FakeBotClient"):
+        self.client = client
+        self.command = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def send_message(self, text: str) -> _BotMessage:
+        self.command = text
+        return _BotMessage(text)
+
+    async def get_response(self) -> _BotMessage:
+        await asyncio.sleep(self.client.bot_delay)
+        if self.command == "/token":
+            return _BotMessage(self.client.api.token)
+        return _BotMessage("Unknown command\n")
+
+
+class FakeBotClient(FakeClient):
+    """Client whose @lavHostBot conversations hand out the mock API token"""
+
+    def __init__(self, api: MockLavHostAPI, bot_delay: float = 0.0):
+        super().__init__()
+        self.api = api
+        self.bot_delay = bot_delay
+        self.conversations = 0
+
+    def conversation(self, entity, **kwargs) -> _Conversation:
+        self.conversations += 1
+        return _Conversation(self)
@@ -0,0 +1,82 @@
+"""Local speedtest.net-compatible server.
+
+Serves the files speedtest-cli expects from a server: `latency.txt`,
+`random<N>x<N>.jpg` downloads and `upload.php` uploads, under `/speedtest/`.
+Each connection can be throttled to a fixed rate, so single-stream and
+multi-stream throughput differ like they do on a real shaped link.
+"""
+
+import asyncio
+import re
+
+from aiohttp import web
+
+CHUNK_SIZE = 64 * 1024
+IMAGE_RE = re.compile(r"^random(\d+)x\1\.jpg$")
+
+
+class SpeedtestServer:
+    """aiohttp server answering speedtest-cli requests"""
+
+    def __init__(self, rate: float = 0.0, latency: float = 0.0):
+        # Per-connection rate limit in bytes per second, 0 for unlimited
+        self.rate = rate
+        self.latency = latency
+        self.bytes_sent = 0
+        self.bytes_received = 0
+
+        self.app = web.Application(client_max_size=64 * 1024 * 1024)
+        self.app.router.add_get("/speedtest/latency.txt", self.latency_txt)
+        self.app.router.add_get("/speedtest/{name}", self.image)
+        self.app.router.add_post("/speedtest/upload.php", self.upload)
+        self.runner = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start server and return its upload URL, to be used as target"""
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{port}/speedtest/upload.php"
+
+    async def close(self):
+        await self.runner.cleanup()
+
+    async def throttle(self, size: int):
+        if self.rate:
+            await asyncio.sleep(size / self.rate)
+
+    async def latency_txt(self, _) -> web.Response:
+        await asyncio.sleep(self.latency)
+        return web.Response(text="test=test")
+
+    async def image(self, request: web.Request) -> web.StreamResponse:
+        match = IMAGE_RE.match(request.match_info["name"])
+        if not match:
+            raise web.HTTPNotFound()
+
+        # Real images weigh about two bytes per pixel
+        size = int(match.group(1)) ** 2 * 2
+        response = web.StreamResponse(headers={"Content-Length": str(size)})
+        await response.prepare(request)
+
+        chunk = bytes(CHUNK_SIZE)
+        while size > 0:
+            n = min(size, CHUNK_SIZE)
+            await self.throttle(n)
+            await response.write(chunk[:n])
+            self.bytes_sent += n
+            size -= n
+
+        await response.write_eof()
+        return response
+
+    async def upload(self, request: web.Request) -> web.Response:
+        received = 0
+        async for data in request.content.iter_chunked(CHUNK_SIZE):
+            await self.throttle(len(data))
+            received += len(data)
+
+        self.bytes_received += received
+        return web.Response(text=f"size={received}")
@@ -0,0 +1,151 @@
+"""Offline latency benchmark for `LavHostMod.api_request`.
+
+Points the module at a local stand-in of the lavHost API and measures
+request latency and throughput (sequential, concurrent and cached), how many
+TCP connections the pooled session opens, and how retries and token refresh
+behave when the server injects 5xx errors, dropped connections and token
+revocations. No network is used.
+
+    python benchmarks/lavhost_api.py --requests 1000 --concurrency 20
+"""
+
+import argparse
+import asyncio
+import logging
+import statistics
+import time
+
+from _ftg import FakeDB, load_module
+from _lavhost import FakeBotClient, MockLavHostAPI
+
+lavhost = load_module("lavhost")
+
+
+def report(name: str, latencies: list, elapsed: float, api: MockLavHostAPI):
+    latencies = sorted(latencies)
+
+    def pct(q):
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1e3
+
+    print(
+        f"{name:<11} {len(latencies) / elapsed:>8,.0f} req/s  "
+        f"mean={statistics.fmean(latencies) * 1e3:.2f} "
+        f"p50={pct(0.5):.2f} p95={pct(0.95):.2f} p99={pct(0.99):.2f} ms  "
+        f"server_requests={api.requests} connections={len(api.connections)}"
+    )
+
+
+async def measure(name, api, calls, concurrency):
+    """Run coroutine factories from `calls`, `concurrency` at a time"""
+    api.reset_stats()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failures = 0
+
+    async def run(call):
+        nonlocal failures
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await call()
+            except lavhost.LavHostAPIError:
+                failures += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run(call) for call in calls))
+    report(name, latencies, time.perf_counter() - started, api)
+    return failures
+
+
+async def run(args):
+    api = MockLavHostAPI(latency=args.latency_ms / 1000, seed=args.seed)
+    base_url = await api.start()
+    client = FakeBotClient(api)
+
+    mod = lavhost.LavHostMod()
+    await mod.client_ready(client, FakeDB())
+    mod.config["BASE_URL"] = base_url
+    n = args.requests
+
+    def information():
+        return mod.request("user/information")
+
+    # Warm up the token and the connection pool
+    await information()
+
+    await measure("sequential", api, [information] * n, 1)
+    await measure("concurrent", api, [information] * n, args.concurrency)
+    await measure(
+        "cached",
+        api,
+        [lambda: mod.api_request("user/information")] * n,
+        args.concurrency,
+    )
+
+    # Faults: 5xx responses and dropped connections are retried
+    api.error_rate = args.error_rate
+    api.reset_rate = args.reset_rate
+    mod.retry_budget = lavhost.RetryBudget(
+        lavhost.RETRY_BUDGET_RATIO, lavhost.RETRY_BUDGET_MAX
+    )
+    failures = await measure(
+        "faults",
+        api,
+        [
+            lambda user_id=user_id: mod.request(
+                "user/check", auth_required=False, user_id=user_id
+            )
+            for user_id in range(n)
+        ],
+        args.concurrency,
+    )
+    print(
+        f"{'':<11} failed={failures}/{n} "
+        f"retries={api.requests - n} "
+        f"statuses={dict(api.statuses)}"
+    )
+
+    # Token revocation: each revocation should cost one bot conversation
+    api.error_rate = api.reset_rate = 0
+    conversations = client.conversations
+
+    def revoking(i):
+        if i % args.rotate_every == 0:
+            api.rotate_token()
+        return information()
+
+    failures = await measure(
+        "token",
+        api,
+        [lambda i=i: revoking(i) for i in range(n)],
+        args.concurrency,
+    )
+    print(
+        f"{'':<11} failed={failures}/{n} "
+        f"revocations={-(-n // args.rotate_every)} "
+        f"bot_conversations={client.conversations - conversations} "
+        f"unauthorized={api.statuses[401]}"
+    )
+
+    await mod.session.close()
+    await api.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=1.0)
+    parser.add_argument("--error-rate", type=float, default=0.1)
+    parser.add_argument("--reset-rate", type=float, default=0.02)
+    parser.add_argument("--rotate-every", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Offline speedtest benchmark against a local stand-in server.
+
+Runs `speedtest_worker` in target mode against `_speedtest_server`, once per
+requested connection count, and reports ping, download and upload speed next
+to what the server actually transferred. With a per-connection rate limit,
+single-stream results show per-connection throughput and multi-stream ones
+show aggregate throughput. No network is used.
+
+    python benchmarks/speedtest_local.py --threads 1 4 8 --rate-mbit 50
+"""
+
+import argparse
+import asyncio
+import functools
+import threading
+import time
+
+from _ftg import load_module
+from _speedtest_server import SpeedtestServer
+
+speedtest = load_module("speedtest")
+
+
+async def run_worker(settings: dict) -> dict:
+    """Run the worker in a thread and collect its final state"""
+    loop = asyncio.get_running_loop()
+    state = {}
+
+    def emit(event: str, data: dict):
+        if event == "error":
+            raise RuntimeError(data["error"])
+        state.update(data)
+
+    await loop.run_in_executor(
+        None,
+        functools.partial(
+            speedtest.speedtest_worker, emit, threading.Event(), settings
+        ),
+    )
+    return state
+
+
+async def run(args):
+    server = SpeedtestServer(
+        rate=args.rate_mbit * 1e6 / 8, latency=args.latency_ms / 1000
+    )
+    target = await server.start()
+
+    print(f"target={target} rate={args.rate_mbit or 'unlimited'} Mbit/s per connection")
+    for threads in args.threads:
+        server.bytes_sent = server.bytes_received = 0
+        started = time.perf_counter()
+        state = await run_worker(
+            {
+                "target": target,
+                "threads": threads,
+                "download_sizes": args.download_sizes,
+                "upload_sizes": args.upload_sizes,
+            }
+        )
+        elapsed = time.perf_counter() - started
+        print(
+            f"threads={threads:<3} ping={state['ping']:.1f} ms  "
+            f"download={state['download'] / 1e6:8.1f} Mbit/s  "
+            f"upload={state['upload'] / 1e6:8.1f} Mbit/s  "
+            f"sent={server.bytes_sent / 2**20:.1f} MiB "
+            f"received={server.bytes_received / 2**20:.1f} MiB  "
+            f"time={elapsed:.1f} s"
+        )
+
+    await server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--rate-mbit", type=float, default=100)
+    parser.add_argument("--latency-ms", type=float, default=1)
+    parser.add_argument(
+        "--download-sizes", type=int, nargs="+", default=[350, 500, 750, 1000]
+    )
+    parser.add_argument(
+        "--upload-sizes", type=int, nargs="+", default=[131072, 262144, 524288]
+    )
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
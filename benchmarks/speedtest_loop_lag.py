@@ -0,0 +1,136 @@
+"""Event loop lag benchmark for `SpeedtestMod` thread and subprocess modes.
+
+Runs a full speedtest through `SpeedtestMod.run_worker` against a local
+stand-in server, first in a worker thread and then in a separate process
+(SUBPROCESS), while a probe measures how late `asyncio.sleep` wakes up on the
+userbot's event loop. The stand-in server runs in its own process, so only the
+worker competes with the loop. No network is used.
+
+    python benchmarks/speedtest_loop_lag.py --threads 4 --repeat 3
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import time
+
+from _ftg import FakeClient, FakeDB, load_module
+from _speedtest_server import SpeedtestServer
+
+speedtest = load_module("speedtest")
+
+PROBE_INTERVAL = 0.01
+
+
+def serve(connection, rate: float, latency: float):
+    """Run stand-in server until the parent sends anything to `connection`"""
+
+    # Connections dropped at the end of a timed stage are expected
+    logging.getLogger("aiohttp.server").setLevel(logging.CRITICAL)
+
+    async def main():
+        server = SpeedtestServer(rate=rate, latency=latency)
+        connection.send(await server.start())
+        await asyncio.get_event_loop().run_in_executor(None, connection.recv)
+
+    asyncio.run(main())
+
+
+async def probe(lags: list, stop: asyncio.Event):
+    """Record how late each PROBE_INTERVAL sleep wakes up"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        started = loop.time()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(loop.time() - started - PROBE_INTERVAL)
+
+
+def report(name: str, lags: list, elapsed: float, state: dict):
+    lags = sorted(lags)
+
+    def pct(q):
+        return lags[min(len(lags) - 1, int(q * len(lags)))] * 1e3
+
+    line = (
+        f"{name:<11} lag p50={pct(0.5):6.2f} p99={pct(0.99):7.2f} "
+        f"max={lags[-1] * 1e3:7.2f} ms  time={elapsed:5.1f} s"
+    )
+    if state:
+        line += (
+            f"  download={state['download'] / 1e6:8.1f} Mbit/s"
+            f"  upload={state['upload'] / 1e6:8.1f} Mbit/s"
+        )
+    print(line)
+
+
+async def measure(name: str, work):
+    lags = []
+    stop = asyncio.Event()
+    task = asyncio.ensure_future(probe(lags, stop))
+    started = time.perf_counter()
+    state = await work()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await task
+    report(name, lags, elapsed, state)
+
+
+async def run(args, target: str):
+    mod = speedtest.SpeedtestMod()
+    mod.config["HISTORY_FILE"] = args.history_file
+    await mod.client_ready(FakeClient(), FakeDB())
+    mod.on_unload()
+    mod.config.update(
+        TARGET_URL=target,
+        THREADS=args.threads,
+        DOWNLOAD_SIZES=args.download_sizes,
+        UPLOAD_SIZES=args.upload_sizes,
+    )
+
+    print(f"target={target} threads={args.threads}")
+
+    async def idle():
+        await asyncio.sleep(args.idle)
+        return {}
+
+    await measure("idle", idle)
+    for name, subprocess in (("thread", False), ("subprocess", True)):
+        mod.config["SUBPROCESS"] = subprocess
+        for _ in range(args.repeat):
+            await measure(name, mod.run_worker)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--rate-mbit", type=float, default=0)
+    parser.add_argument("--latency-ms", type=float, default=1)
+    parser.add_argument("--idle", type=float, default=3)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument(
+        "--download-sizes", type=int, nargs="+", default=[1500, 2000, 2500, 3000]
+    )
+    parser.add_argument(
+        "--upload-sizes", type=int, nargs="+", default=[524288, 1048576]
+    )
+    parser.add_argument("--history-file", default="/tmp/speedtest_loop_lag.bin")
+    args = parser.parse_args()
+
+    parent, child = multiprocessing.Pipe()
+    server = multiprocessing.Process(
+        target=serve,
+        args=(child, args.rate_mbit * 1e6 / 8, args.latency_ms / 1000),
+        daemon=True,
+    )
+    server.start()
+    child.close()
+    try:
+        asyncio.run(run(args, parent.recv()))
+    finally:
+        parent.send(None)
+        server.join(5)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Startup cost benchmark: module import and `client_ready` time.
+
+Each module is loaded in a fresh interpreter, so import caches don't leak
+between measurements. Telethon is imported before timing starts, because the
+host has always loaded it already. Pass ``--rev`` to measure module files
+from another git revision, e.g. to compare before and after a change:
+
+    python benchmarks/startup.py --rev HEAD~1
+    python benchmarks/startup.py
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+from _ftg import REPO_DIR
+
+MODULES = ["lavhost", "membersquery", "msgrate", "speedtest", "swmute"]
+
+# Module __init__ is counted as part of client_ready
+CHILD = """
+import asyncio, json, sys, time
+sys.path.insert(0, {bench_dir!r})
+import telethon, telethon.tl.custom, telethon.tl.functions.channels
+from _ftg import FakeClient, FakeDB, load_module
+
+started = time.perf_counter()
+module = load_module({name!r}, {directory!r})
+imported = time.perf_counter()
+
+cls = next(
+    getattr(module, attr)
+    for attr in dir(module)
+    if attr.endswith("Mod") and getattr(module, attr).__module__ == module.__name__
+)
+
+
+async def start():
+    # Modules may create loop-bound objects in __init__, so it runs in the loop
+    started = time.perf_counter()
+    await cls().client_ready(FakeClient(), FakeDB())
+    return time.perf_counter() - started
+
+
+ready = asyncio.run(start())
+
+print(json.dumps({{"import": imported - started, "client_ready": ready}}))
+"""
+
+
+def measure(name: str, directory: Path) -> dict:
+    """Load module `name` from `directory` in a new interpreter"""
+    bench_dir = Path(__file__).resolve().parent
+    code = CHILD.format(bench_dir=str(bench_dir), name=name, directory=str(directory))
+    # Run outside the repository root, so `import speedtest` finds the library
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=bench_dir,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if result.returncode:
+        raise RuntimeError(f"Failed to load {name}:\n{result.stderr}")
+
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def export_revision(rev: str, directory: Path):
+    """Write module files from git revision `rev` to `directory`"""
+    for name in MODULES:
+        source = subprocess.run(
+            ["git", "show", f"{rev}:{name}.py"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            check=True,
+        ).stdout
+        (directory / f"{name}.py").write_bytes(source)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rev", help="git revision to take modules from")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = REPO_DIR
+        if args.rev:
+            directory = Path(tmp)
+            export_revision(args.rev, directory)
+
+        print(f"{'module':<14}{'import, ms':>12}{'client_ready, ms':>18}")
+        for name in args.modules:
+            runs = [measure(name, directory) for _ in range(args.repeat)]
+            print(
+                f"{name:<14}"
+                f"{statistics.median(r['import'] for r in runs) * 1000:>12.1f}"
+                f"{statistics.median(r['client_ready'] for r in runs) * 1000:>18.1f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
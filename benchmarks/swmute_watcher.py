@@ -0,0 +1,152 @@
+"""Offline throughput benchmark for `SwmuteMod.watcher`.
+
+Feeds a synthetic stream of group messages through the watcher with a fake
+client and database, then reports messages per second, per-message latency
+percentiles and memory allocations. No network is used.
+
+    python benchmarks/swmute_watcher.py --chats 2000 --mutes 20000 --messages 50000
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+import tracemalloc
+
+from telethon.tl import types
+from telethon.tl.custom import Message
+
+from _ftg import FakeClient, FakeDB, load_module
+
+swmute = load_module("swmute")
+
+
+def build_mutes(chat_ids, mutes_count, rng):
+    """Spread `mutes_count` mutes over chats, a quarter of them temporary"""
+    mutes = {}
+    now = int(time.time())
+    for _ in range(mutes_count):
+        chat_id = rng.choice(chat_ids)
+        user_id = rng.randrange(1_000_000, 2_000_000)
+        until = 0 if rng.random() < 0.75 else now + rng.randrange(3600, 86400)
+        mutes.setdefault(str(chat_id), {})[str(user_id)] = until
+    return mutes
+
+
+def build_messages(client, channels, mutes, count, muted_ratio, rng):
+    """Build `count` messages, `muted_ratio` of them from muted senders"""
+    chat_ids = list(channels)
+    messages = []
+    for msg_id in range(1, count + 1):
+        chat_id = rng.choice(chat_ids)
+        chat_mutes = mutes.get(str(chat_id))
+        if chat_mutes and rng.random() < muted_ratio:
+            sender_id = int(rng.choice(list(chat_mutes)))
+        else:
+            sender_id = rng.randrange(3_000_000, 4_000_000)
+
+        channel = channels[chat_id]
+        message = Message(
+            id=msg_id,
+            peer_id=types.PeerChannel(channel.id),
+            from_id=types.PeerUser(sender_id),
+            message="spam",
+            date=None,
+        )
+        message._finish_init(client, {chat_id: channel}, None)
+        messages.append(message)
+    return messages
+
+
+async def run(args):
+    rng = random.Random(args.seed)
+    client = FakeClient()
+    db = FakeDB()
+
+    channels = {}
+    for n in range(args.chats):
+        channel = types.Channel(
+            id=1_000_000_000 + n,
+            title=f"chat {n}",
+            photo=types.ChatPhotoEmpty(),
+            date=None,
+            megagroup=True,
+            access_hash=n,
+        )
+        channels[-1_000_000_000_000 - channel.id] = channel
+
+    mutes = build_mutes(list(channels), args.mutes, rng)
+    messages = build_messages(
+        client, channels, mutes, args.messages, args.muted_ratio, rng
+    )
+
+    mod = swmute.SwmuteMod()
+    await mod.client_ready(client, db)
+    db.set(mod.strings("name"), "mutes", mutes)
+
+    # Warm up caches and code paths before measuring
+    for message in messages[: min(1000, len(messages))]:
+        await mod.watcher(message)
+
+    mod.metrics = swmute.SwmuteMetrics()
+    client.deleted.clear()
+    latencies = []
+
+    started = time.perf_counter()
+    for message in messages:
+        t = time.perf_counter()
+        await mod.watcher(message)
+        latencies.append(time.perf_counter() - t)
+    elapsed = time.perf_counter() - started
+
+    stats = mod.metrics.snapshot()
+    delete_calls = len(client.deleted)
+
+    # Allocations are measured in a separate pass, tracemalloc skews timings
+    client.deleted.clear()
+    tracemalloc.start()
+    snapshot_before = tracemalloc.take_snapshot()
+    for message in messages:
+        await mod.watcher(message)
+    snapshot_after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    allocated = sum(
+        stat.size_diff
+        for stat in snapshot_after.compare_to(snapshot_before, "filename")
+        if stat.size_diff > 0
+    )
+    latencies.sort()
+
+    def pct(q):
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1e6
+
+    print(f"chats={args.chats} mutes={args.mutes} messages={len(messages)}")
+    print(f"matched={stats['matched']} delete_calls={delete_calls}")
+    print(f"throughput: {len(messages) / elapsed:,.0f} msg/s")
+    print(
+        "latency us: "
+        f"mean={statistics.fmean(latencies) * 1e6:.1f} "
+        f"p50={pct(0.5):.1f} p95={pct(0.95):.1f} p99={pct(0.99):.1f} "
+        f"max={latencies[-1] * 1e6:.1f}"
+    )
+    print(
+        f"memory: retained={allocated / 1024:.1f} KiB peak={peak / 1024:.1f} KiB "
+        f"({allocated / len(messages):.1f} B/msg)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--chats", type=int, default=2000)
+    parser.add_argument("--mutes", type=int, default=20000)
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--muted-ratio", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
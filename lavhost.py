@@ -17,22 +17,77 @@
 # meta developer: @nalinormods
 # requires: aiohttp
 
+import asyncio
+import csv
 import functools
 import logging
+import random
+import re
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Any, Callable
+from io import BytesIO, StringIO
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
 
-import aiohttp
 from telethon import TelegramClient
-from telethon.errors.rpcerrorlist import YouBlockedUserError
-from telethon.tl.custom import Message
+from telethon.errors import RPCError
+from telethon.errors.rpcerrorlist import (
+    FloodWaitError,
+    QueryIdInvalidError,
+    YouBlockedUserError,
+)
+from telethon.tl.custom import InlineResults, Message
 from telethon.tl.functions.channels import JoinChannelRequest
 from telethon.tl.functions.contacts import UnblockRequest
+from telethon.tl.types import InputPeerUser
+from telethon.utils import get_display_name
 
 from .. import loader, main, utils
 
+if TYPE_CHECKING:
+    import aiohttp
+
 logger = logging.getLogger(__name__)
 
+# Connection pool of lavHost API session
+CONNECTION_LIMIT = 10
+KEEPALIVE_TIMEOUT = 60
+DNS_CACHE_TTL = 300
+# Request timeouts, in seconds
+CONNECT_TIMEOUT = 5
+REQUEST_TIMEOUT = 15
+
+# API method -> config option with its response cache TTL
+CACHE_TTL_OPTIONS = {
+    "user/information": "INFO_CACHE_TTL",
+    "user/check": "CHECK_CACHE_TTL",
+}
+# ETags of this many recent responses of the methods above are kept
+ETAG_CACHE_SIZE = 256
+
+# Bulk subscription checks
+CHECK_CONCURRENCY = 8
+# Usernames are resolved slowly, Telegram floods on ResolveUsername quickly
+RESOLVE_CONCURRENCY = 2
+MAX_BULK_CHECK = 5000
+# Only these words of a message are taken for users to check
+TARGET_RE = re.compile(
+    r"^(?:\d+|@\w{4,32}|(?:https?://)?(?:t|telegram)\.me/\w{4,32}/?)$"
+)
+
+# Retries of failed API requests
+REQUEST_RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_BACKOFF_MAX = 8
+# Each request adds RETRY_BUDGET_RATIO retries to the budget, up to RETRY_BUDGET_MAX
+RETRY_BUDGET_RATIO = 0.2
+RETRY_BUDGET_MAX = 10
+
+# Subscription monitor, intervals in seconds
+MONITOR_MIN_INTERVAL = 60
+MONITOR_MAX_INTERVAL = 6 * 3600
+MONITOR_FIELDS = ("type", "server", "userbot", "expires_date")
+
 
 class LavHostError(RuntimeError):
     """Basic class for all lavHost-related errors"""
@@ -59,6 +114,30 @@ class LavHostNotRegisteredError(LavHostError):
         super().__init__(*args)
 
 
+class RetryBudget:
+    """
+    Allows retries for a fraction of requests only,
+    so retries can't multiply the load when the API is down
+    """
+
+    def __init__(self, ratio: float, maximum: int):
+        self.ratio = ratio
+        self.maximum = maximum
+        self.balance = float(maximum)
+
+    def deposit(self):
+        """Account a new request"""
+        self.balance = min(self.balance + self.ratio, self.maximum)
+
+    def withdraw(self) -> bool:
+        """Take a retry from the budget, return False if it's exhausted"""
+        if self.balance < 1:
+            return False
+
+        self.balance -= 1
+        return True
+
+
 def error_handler(func) -> Callable:
     """Decorator to handle lavHost-related exceptions"""
 
@@ -135,11 +214,32 @@ class LavHostMod(loader.Module):
         ),
         "support_chat": "✌️ Support chat",
         "no_target": "🧐 <b>Whom should I check?</b>",
+        "flood_wait": (
+            "⏳ <b>Telegram asks to wait {seconds} seconds before resolving more"
+            " usernames</b>"
+        ),
         "check_True": "✅ <b>Yes, <code>{id}</code> has active lavHost subscription</b>",
         "check_False": "❌ <b>No, <code>{id}</code> doesn't have lavHost subscription</b>",
         "stopped": "✅ <b>Stopped</b>",
         "started": "✅ <b>Started</b>",
         "restarted": "✅ <b>Restarted</b>",
+        "check_summary": (
+            "📋 <b>Checked {total} users</b>\n\n"
+            "✅ <b>Active:</b> {active}\n"
+            "❌ <b>Inactive:</b> {inactive}\n"
+            "⚠️ <b>Failed:</b> {failed}"
+        ),
+        "cfg_info_cache_ttl": "How long user/information responses are cached, in seconds",
+        "cfg_check_cache_ttl": "How long user/check responses are cached, in seconds",
+        "cfg_base_url": "lavHost API URL",
+        "cfg_monitor": "Watch lavHost subscription in background and notify about changes",
+        "cfg_monitor_interval": "How often subscription is checked, in seconds",
+        "cfg_expiry_warning": "Warn this many days before subscription expires",
+        "monitor_expired": "🚫 <b>Your lavHost subscription has expired</b>",
+        "monitor_active": "✅ <b>Your lavHost subscription is active again</b>",
+        "monitor_changed": "🔔 <b>Your lavHost information has changed</b>\n\n{changes}",
+        "monitor_change": "▫️ <b>{field}:</b> <code>{old}</code> → <code>{new}</code>",
+        "monitor_expiring": "⏳ <b>Your lavHost subscription expires in {time}</b>",
     }
 
     strings_ru = {
@@ -153,6 +253,10 @@ class LavHostMod(loader.Module):
             "<reply/username/id> — "
             "Проверить, зарегистрирован ли пользователь на lavHost"
         ),
+        "_cmd_doc_lcheckall": (
+            "<users/reply/chat> — Проверить подписку на lavHost у списка "
+            "пользователей, пользователей из ответа или всех участников чата"
+        ),
         "not_registered": "🚫 <b>У тебя нет активной подписки в {bot_username}</b>",
         "api_error": "🚫 <b>Ошибка API в </b><code>{method_name}</code>: <code>{text}</code>",
         "loading": "🔍 <b>Загрузка...</b>",
@@ -184,20 +288,97 @@ class LavHostMod(loader.Module):
         ),
         "support_chat": "✌️ Чат поддержки",
         "no_target": "🧐 <b>Кого мне надо проверить?</b>",
+        "flood_wait": (
+            "⏳ <b>Telegram просит подождать {seconds} секунд, прежде чем искать"
+            " ещё юзернеймы</b>"
+        ),
         "check_True": "✅ <b>Да, <code>{id}</code> имеет активную подписку на lavHost</b>",
         "check_False": "❌ <b>Нет, <code>{id}</code> не имеет подписку на lavHost</b>",
         "stopped": "✅ <b>Юзербот остановлен</b>",
         "started": "✅ <b>Юзербот запущен</b>",
         "restarted": "✅ <b>Юзербот перезапущен</b>",
+        "check_summary": (
+            "📋 <b>Проверено пользователей: {total}</b>\n\n"
+            "✅ <b>С подпиской:</b> {active}\n"
+            "❌ <b>Без подписки:</b> {inactive}\n"
+            "⚠️ <b>Не удалось проверить:</b> {failed}"
+        ),
+        "cfg_info_cache_ttl": "Сколько секунд хранить ответы user/information",
+        "cfg_check_cache_ttl": "Сколько секунд хранить ответы user/check",
+        "cfg_base_url": "Адрес API lavHost",
+        "cfg_monitor": "Следить за подпиской lavHost в фоне и сообщать об изменениях",
+        "cfg_monitor_interval": "Как часто проверять подписку, в секундах",
+        "cfg_expiry_warning": "За сколько дней предупреждать об окончании подписки",
+        "monitor_expired": "🚫 <b>Твоя подписка на lavHost закончилась</b>",
+        "monitor_active": "✅ <b>Твоя подписка на lavHost снова активна</b>",
+        "monitor_changed": "🔔 <b>Твоя информация на lavHost изменилась</b>\n\n{changes}",
+        "monitor_change": "▫️ <b>{field}:</b> <code>{old}</code> → <code>{new}</code>",
+        "monitor_expiring": "⏳ <b>Твоя подписка на lavHost заканчивается через {time}</b>",
     }
 
     def __init__(self):
         self.bot = "@lavHostBot"
-        self.session = aiohttp.ClientSession()
+        self.session = None
+        self.token: Optional[str] = None
+        self.inline_results: Optional[InlineResults] = None
+        # (method, auth, params) -> (response, expiration time)
+        self.cache: Dict[tuple, Tuple[dict, float]] = {}
+        self.inflight: Dict[tuple, asyncio.Future] = {}
+        # Bumped on invalidation, so fetches started earlier aren't cached
+        self.cache_generation = 0
+        # (method, params) -> (ETag, response) for conditional requests, LRU
+        self.etags: Dict[tuple, Tuple[str, dict]] = OrderedDict()
+        self.monitor_task: Optional[asyncio.Task] = None
+        self.token_lock = asyncio.Lock()
+        self.retry_budget = RetryBudget(RETRY_BUDGET_RATIO, RETRY_BUDGET_MAX)
+        self.config = loader.ModuleConfig(
+            "INFO_CACHE_TTL",
+            30,
+            lambda m: self.strings("cfg_info_cache_ttl", m),
+            "CHECK_CACHE_TTL",
+            600,
+            lambda m: self.strings("cfg_check_cache_ttl", m),
+            "BASE_URL",
+            "https://api.lavhost.su",
+            lambda m: self.strings("cfg_base_url", m),
+            "MONITOR",
+            False,
+            lambda m: self.strings("cfg_monitor", m),
+            "MONITOR_INTERVAL",
+            600,
+            lambda m: self.strings("cfg_monitor_interval", m),
+            "EXPIRY_WARNING",
+            3,
+            lambda m: self.strings("cfg_expiry_warning", m),
+        )
+
+    def on_unload(self):
+        """on_unload hook"""
+        if self.monitor_task:
+            self.monitor_task.cancel()
+        if self.session and not self.session.closed:
+            asyncio.ensure_future(self.session.close())
+
+    def get_session(self) -> "aiohttp.ClientSession":
+        """
+        Get HTTP session with pooled keep-alive connections.
+        It's created on first use, inside the running event loop
+        """
+        if self.session is None or self.session.closed:
+            import aiohttp  # pylint: disable=import-outside-toplevel
+
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=CONNECTION_LIMIT,
+                    keepalive_timeout=KEEPALIVE_TIMEOUT,
+                    ttl_dns_cache=DNS_CACHE_TTL,
+                ),
+                timeout=aiohttp.ClientTimeout(
+                    total=REQUEST_TIMEOUT, connect=CONNECT_TIMEOUT
+                ),
+            )
 
-    def __del__(self):
-        # noinspection PyProtectedMember
-        self.session._connector._close()
+        return self.session
 
     async def client_ready(self, client: TelegramClient, db):
         """client_ready hook"""
@@ -206,6 +387,8 @@ class LavHostMod(loader.Module):
 
         await client(JoinChannelRequest(channel=self.strings("author")))
 
+        self.monitor_task = asyncio.ensure_future(self.monitor())
+
     def get_prefix(self) -> str:
         """Get command prefix"""
         return self.db.get(main.__name__, "command_prefix") or "."
@@ -218,13 +401,28 @@ class LavHostMod(loader.Module):
         """Set value in database"""
         return self.db.set(self.strings("name"), key, value)
 
+    async def get_inline_results(self) -> InlineResults:
+        """Get inline results of `self.bot`, reused while their cache time is valid"""
+        if self.inline_results is None or not self.inline_results.results_valid():
+            self.inline_results = None
+            query = await self.client.inline_query(self.bot, "", entity="me")
+            if len(query) == 1:
+                raise LavHostNotRegisteredError
+            self.inline_results = query
+
+        return self.inline_results
+
     async def inline_click(self, index: int):
         """Click on inline result from `self.bot` at given index and delete message"""
-        query = await self.client.inline_query(self.bot, "", entity="me")
-        if len(query) == 1:
-            raise LavHostNotRegisteredError
+        query = await self.get_inline_results()
+        try:
+            m = await query[index].click()
+        except QueryIdInvalidError:
+            # The bot forgot the query earlier than promised, query it again
+            self.inline_results = None
+            m = await (await self.get_inline_results())[index].click()
 
-        await (await query[index].click()).delete()
+        await m.delete()
 
     async def get_response(self, command: str) -> Message:
         """Get response from `self.bot` about command `command`"""
@@ -243,33 +441,347 @@ class LavHostMod(loader.Module):
         return r
 
     async def get_token(self):
-        """Retrieve token for lavHost API"""
-        if token := self.get("token"):
-            return token
+        """Retrieve token for lavHost API, kept in memory and backed by the db"""
+        if self.token:
+            return self.token
 
-        r = await self.get_response("/token")
-        if "\n" in r.raw_text:
-            raise LavHostNotRegisteredError
+        # Only one caller talks to the bot, the others wait for its token
+        async with self.token_lock:
+            if not self.token:
+                self.token = self.get("token")
+            if not self.token:
+                r = await self.get_response("/token")
+                if "\n" in r.raw_text:
+                    raise LavHostNotRegisteredError
+
+                self.token = r.raw_text
+                self.set("token", self.token)
+
+            return self.token
+
+    async def refresh_token(self, stale_token: str) -> str:
+        """Replace rejected token, unless another caller has done it already"""
+        async with self.token_lock:
+            if self.token == stale_token:
+                self.token = None
+                self.set("token", None)
 
-        self.set("token", r.raw_text)
-        return r.raw_text
+        return await self.get_token()
 
     async def api_request(self, method_name: str, auth_required=True, **kwargs) -> dict:
-        """Make request to lavHost API and return result"""
+        """
+        Make request to lavHost API and return result.
+        Responses are cached, and identical concurrent requests are made once
+        """
+        key = (method_name, auth_required, tuple(sorted(kwargs.items())))
+        if key in self.cache and self.cache[key][1] > time.monotonic():
+            return self.cache[key][0]
+
+        if key not in self.inflight:
+
+            async def fetch() -> dict:
+                generation = self.cache_generation
+                result = await self.request(method_name, auth_required, **kwargs)
+                ttl = self.get_cache_ttl(method_name)
+                if ttl and generation == self.cache_generation:
+                    self.cache[key] = (result, time.monotonic() + ttl)
+                return result
+
+            def done(task: asyncio.Future):
+                if self.inflight.get(key) is task:
+                    del self.inflight[key]
+
+            task = asyncio.ensure_future(fetch())
+            task.add_done_callback(done)
+            self.inflight[key] = task
+
+        # Shielded, so a cancelled caller doesn't cancel the request for others
+        return await asyncio.shield(self.inflight[key])
+
+    def get_cache_ttl(self, method_name: str) -> int:
+        """Get response cache TTL of API method, 0 if it's not cached"""
+        option = CACHE_TTL_OPTIONS.get(method_name)
+        return int(self.config[option] or 0) if option else 0
+
+    def invalidate_cache(self):
+        """Drop all cached API responses, including ones being fetched"""
+        self.cache.clear()
+        self.inflight.clear()
+        self.cache_generation += 1
+
+    @staticmethod
+    def get_targets(text: str) -> List[str]:
+        """Get ids, @usernames and t.me links from text, in order, without repeats"""
+        return list(
+            dict.fromkeys(
+                word for word in text.replace(",", " ").split() if TARGET_RE.match(word)
+            )
+        )
+
+    async def resolve_users(
+        self, targets: List[str]
+    ) -> Tuple[Dict[int, str], List[str]]:
+        """
+        Resolve ids and usernames to user ids, `RESOLVE_CONCURRENCY` at a time.
+        Returns user id -> target mapping and targets which aren't users.
+        `FloodWaitError` stops resolving and is raised
+        """
+        users = {}
+        names = []
+        for target in targets:
+            if target.isdigit():
+                users[int(target)] = target
+            else:
+                names.append(target)
+
+        unresolved = []
+        pending = iter(names)
+
+        async def resolve():
+            for name in pending:  # shared by all workers
+                try:
+                    entity = await self.client.get_input_entity(name)
+                except FloodWaitError:
+                    raise
+                except (ValueError, TypeError, RPCError):
+                    entity = None
+
+                if isinstance(entity, InputPeerUser):
+                    users[entity.user_id] = name
+                else:
+                    unresolved.append(name)
+
+        workers = [asyncio.ensure_future(resolve()) for _ in range(RESOLVE_CONCURRENCY)]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+        return users, unresolved
+
+    async def get_chat_users(self, chat) -> Dict[int, str]:
+        """Get user id -> name mapping of chat members, excluding bots"""
+        return {
+            user.id: user.username or get_display_name(user)
+            async for user in self.client.iter_participants(chat, limit=MAX_BULK_CHECK)
+            if not user.bot and not user.deleted
+        }
+
+    async def check_user(self, user_id: int) -> Optional[bool]:
+        """Check if user has active subscription, None if the check failed"""
+        try:
+            resp = await self.api_request(
+                "user/check", auth_required=False, user_id=user_id
+            )
+        except LavHostAPIError:
+            logger.debug("Check of %d failed", user_id, exc_info=True)
+            return None
+
+        return resp["active_user"]
+
+    async def check_users(self, user_ids: List[int]) -> Dict[int, Optional[bool]]:
+        """Check subscriptions of many users, `CHECK_CONCURRENCY` at a time"""
+        semaphore = asyncio.Semaphore(CHECK_CONCURRENCY)
+
+        async def check(user_id: int) -> Optional[bool]:
+            async with semaphore:
+                return await self.check_user(user_id)
+
+        results = await asyncio.gather(*(check(user_id) for user_id in user_ids))
+        return dict(zip(user_ids, results))
+
+    async def request(self, method_name: str, auth_required=True, **kwargs) -> dict:
+        """
+        Make uncached request to lavHost API and return result.
+        Timeouts, connection and server errors are retried with backoff
+        while the retry budget allows, rejected token is refreshed once
+        """
+        import aiohttp  # pylint: disable=import-outside-toplevel
+
+        url = f"{self.config['BASE_URL'].rstrip('/')}/{method_name}"
+        key = (method_name, tuple(sorted(kwargs.items())))
+        conditional = method_name in CACHE_TTL_OPTIONS
         token = await self.get_token() if auth_required else ""
+        token_refreshed = False
+        attempt = 0
+        self.retry_budget.deposit()
+
+        while True:
+            headers = {"Authorization": f"Bearer {token}"}
+            cached = self.etags.get(key) if conditional else None
+            if cached:
+                headers["If-None-Match"] = cached[0]
+
+            refresh = False
+            try:
+                async with self.get_session().get(
+                    url, params=kwargs, headers=headers
+                ) as resp:
+                    if resp.status == 304:
+                        if cached:
+                            self.etags.move_to_end(key)
+                            return cached[1]
+                        if not conditional:
+                            raise LavHostAPIError(method_name, "Unexpected 304")
+                        # Nothing to revalidate, ask for the full response
+                        conditional = False
+                        continue
+                    if resp.ok:
+                        result = await resp.json()
+                        if conditional and (etag := resp.headers.get("ETag")):
+                            self.etags[key] = (etag, result)
+                            self.etags.move_to_end(key)
+                            while len(self.etags) > ETAG_CACHE_SIZE:
+                                self.etags.popitem(last=False)
+                        return result
+
+                    error = LavHostAPIError(method_name, await resp.text())
+                    if resp.status in {401, 403} and auth_required:
+                        if token_refreshed:
+                            raise error
+                        refresh = True
+                    elif resp.status < 500:
+                        raise error  # client errors won't go away on retry
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                error = LavHostAPIError(method_name, str(e) or type(e).__name__)
+
+            if refresh:
+                # Outside of the response, so the connection is released during
+                # the bot conversation and its errors aren't retried as API ones
+                token = await self.refresh_token(token)
+                token_refreshed = True
+                continue
+
+            if attempt >= REQUEST_RETRIES or not self.retry_budget.withdraw():
+                raise error
+
+            # Exponential backoff with full jitter
+            delay = random.uniform(
+                0, min(RETRY_BACKOFF * 2**attempt, RETRY_BACKOFF_MAX)
+            )
+            logger.debug("Retrying %s in %.2fs: %s", method_name, delay, error)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    @staticmethod
+    def get_expires_date(info: dict) -> datetime:
+        """Get subscription expiration date from user information, in UTC"""
+        return datetime.fromisoformat(info["expires_date"]) - timedelta(hours=3)
+
+    async def get_monitor_state(self) -> dict:
+        """Get subscription state tracked by the monitor"""
+        try:
+            info = await self.api_request("user/information")
+        except LavHostNotRegisteredError:
+            return {"active": False}
+
+        return {
+            "active": self.get_expires_date(info) > datetime.utcnow(),
+            **{field: info[field] for field in MONITOR_FIELDS},
+        }
+
+    async def notify(self, text: str):
+        """Send monitor notification to saved messages"""
+        await self.client.send_message("me", text)
+
+    async def check_state(self) -> bool:
+        """
+        Compare subscription state with the last one and notify about changes
+        and approaching expiry. Returns whether anything has changed
+        """
+        state = await self.get_monitor_state()
+        old_state = self.get("monitor_state")
+        self.set("monitor_state", state)
+
+        if old_state is None or old_state == state:
+            changed = False
+        elif old_state["active"] != state["active"]:
+            changed = True
+            await self.notify(
+                self.strings("monitor_active" if state["active"] else "monitor_expired")
+            )
+        else:
+            changed = True
+            await self.notify(
+                self.strings("monitor_changed").format(
+                    changes="\n".join(
+                        self.strings("monitor_change").format(
+                            field=field,
+                            old=utils.escape_html(str(old_state.get(field))),
+                            new=utils.escape_html(str(state.get(field))),
+                        )
+                        for field in MONITOR_FIELDS
+                        if old_state.get(field) != state.get(field)
+                    )
+                )
+            )
+
+        if state["active"] and self.get("expiry_warned") != state["expires_date"]:
+            expires_in = self.get_expires_date(state) - datetime.utcnow()
+            if expires_in < timedelta(days=self.config["EXPIRY_WARNING"]):
+                self.set("expiry_warned", state["expires_date"])
+                days, hours = expires_in.days, expires_in.seconds // 3600
+                time_left = (
+                    self.strings(f"days_{self.plural_number(days)}").format(x=days)
+                    if days
+                    else self.strings(f"hours_{self.plural_number(hours)}").format(
+                        x=hours
+                    )
+                )
+                await self.notify(
+                    self.strings("monitor_expiring").format(time=time_left)
+                )
 
-        async with self.session.get(
-            f"https://api.lavhost.su/{method_name}",
-            params=kwargs,
-            headers={"Authorization": f"Bearer {token}"},
-        ) as resp:
-            if not resp.ok:
-                if resp.status in [401, 403] and auth_required:
-                    self.set("token", None)  # refetch token
-                    return await self.api_request(method_name, auth_required, **kwargs)
-                raise LavHostAPIError(method_name, await resp.text())
+        return changed
+
+    def get_monitor_delay(self, interval: float) -> float:
+        """Cap monitor delay, so expiry and its warning aren't noticed too late"""
+        state = self.get("monitor_state")
+        if not state or not state["active"]:
+            return interval
+
+        expires_date = self.get_expires_date(state)
+        warn_at = expires_date - timedelta(days=self.config["EXPIRY_WARNING"])
+        for moment in (warn_at, expires_date):
+            seconds = (moment - datetime.utcnow()).total_seconds()
+            if seconds > 0:
+                interval = min(interval, seconds)
+
+        return max(interval, MONITOR_MIN_INTERVAL)
+
+    def get_monitor_interval(self) -> float:
+        """Get MONITOR_INTERVAL, raised to MONITOR_MIN_INTERVAL if lower"""
+        return max(self.config["MONITOR_INTERVAL"] or 0, MONITOR_MIN_INTERVAL)
+
+    async def monitor(self):
+        """
+        Watch subscription state in background while MONITOR is enabled.
+        Interval doubles while nothing changes or API fails. While disabled,
+        it only wakes up every MONITOR_MIN_INTERVAL to notice being enabled
+        """
+        interval = self.get_monitor_interval()
+        while True:
+            if not self.config["MONITOR"]:
+                interval = self.get_monitor_interval()
+                await asyncio.sleep(MONITOR_MIN_INTERVAL)
+                continue
 
-            return await resp.json()
+            try:
+                changed = await self.check_state()
+            except LavHostError:
+                logger.debug("Monitor check failed", exc_info=True)
+                changed = False
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Monitor check failed")
+                changed = False
+
+            interval = (
+                self.get_monitor_interval()
+                if changed
+                else min(interval * 2, MONITOR_MAX_INTERVAL)
+            )
+            await asyncio.sleep(self.get_monitor_delay(interval))
 
     @staticmethod
     def plural_number(n: int) -> str:
@@ -287,6 +799,7 @@ class LavHostMod(loader.Module):
     async def lstopcmd(self, message: Message):
         """Stop userbot"""
         await self.inline_click(0)
+        self.invalidate_cache()
         await utils.answer(message, self.strings("stopped"))
 
     @loader.owner
@@ -294,6 +807,7 @@ class LavHostMod(loader.Module):
     async def lstartcmd(self, message: Message):
         """Start userbot"""
         await self.inline_click(1)
+        self.invalidate_cache()
         await utils.answer(message, self.strings("started"))
 
     @loader.owner
@@ -301,6 +815,7 @@ class LavHostMod(loader.Module):
     async def lrestartcmd(self, message: Message):
         """Restart userbot"""
         await self.inline_click(2)
+        self.invalidate_cache()
         await utils.answer(message, self.strings("restarted"))
 
     @error_handler
@@ -310,9 +825,7 @@ class LavHostMod(loader.Module):
 
         info = await self.api_request("user/information")
 
-        expires_date = datetime.fromisoformat(info["expires_date"]) - timedelta(
-            hours=3
-        )  # convert time to UTC format
+        expires_date = self.get_expires_date(info)
         expires_ts = expires_date.timestamp() if expires_date.year != 9999 else 0
 
         if expires_date < datetime.utcnow():
@@ -416,3 +929,71 @@ class LavHostMod(loader.Module):
         await utils.answer(
             message, self.strings(f"check_{resp['active_user']}").format(id=user_id)
         )
+
+    @loader.owner
+    @error_handler
+    async def lcheckallcmd(self, message: Message):
+        """<users/reply/chat> — Check lavHost subscriptions of many users at once"""
+        raw = utils.get_args_raw(message)
+        reply = await message.get_reply_message()
+        if not raw and reply and reply.raw_text:
+            raw = reply.raw_text
+
+        targets = self.get_targets(raw)
+        if raw and not targets:
+            return await utils.answer(message, self.strings("no_target"))
+
+        m = await utils.answer(message, self.strings("loading"))
+
+        unresolved = []
+        if not targets:
+            if message.is_private:
+                return await utils.answer(m, self.strings("no_target"))
+            try:
+                users = await self.get_chat_users(message.chat_id)
+            except RPCError:
+                logger.debug("Can't get members of %s", message.chat_id, exc_info=True)
+                return await utils.answer(m, self.strings("no_target"))
+        else:
+            try:
+                users, unresolved = await self.resolve_users(targets[:MAX_BULK_CHECK])
+            except FloodWaitError as e:
+                return await utils.answer(
+                    m, self.strings("flood_wait").format(seconds=e.seconds)
+                )
+            if not users and len(unresolved) == 1:
+                # The only target is a chat, check its members
+                try:
+                    users = await self.get_chat_users(unresolved[0])
+                    unresolved = []
+                except (TypeError, ValueError, RPCError):
+                    pass
+
+        if not users and not unresolved:
+            return await utils.answer(m, self.strings("no_target"))
+
+        results = await self.check_users(list(users))
+        statuses = {True: "active", False: "inactive", None: "failed"}
+
+        text = StringIO()
+        writer = csv.writer(text)
+        writer.writerow(["user_id", "name", "status"])
+        for user_id, name in users.items():
+            writer.writerow([user_id, name, statuses[results[user_id]]])
+        for name in unresolved:
+            writer.writerow(["", name, "unresolved"])
+
+        stream = BytesIO(text.getvalue().encode())
+        stream.name = "lavhost_check.csv"
+
+        values = list(results.values())
+        await utils.answer(
+            m,
+            self.strings("check_summary").format(
+                total=len(users) + len(unresolved),
+                active=values.count(True),
+                inactive=values.count(False),
+                failed=values.count(None) + len(unresolved),
+            ),
+        )
+        await self.client.send_file(message.chat_id, stream, reply_to=message.id)
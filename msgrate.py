@@ -15,14 +15,33 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # meta developer: @nalinormods
-# requires: matplotlib
+# requires: matplotlib numpy
 
+import asyncio
+import math
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import suppress
+from datetime import datetime, timedelta, timezone
 from io import BytesIO
-from typing import Awaitable
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
 
-import matplotlib.pyplot as plt
 from telethon import TelegramClient
+from telethon.errors import RPCError
 from telethon.hints import EntityLike
 from telethon.tl.custom import Message
 from telethon.tl.functions.channels import JoinChannelRequest
@@ -30,6 +49,228 @@ from telethon.tl.types import MessageEmpty
 
 from .. import loader, utils
 
+# numpy and matplotlib are imported on first use to keep module load cheap
+if TYPE_CHECKING:
+    import numpy as np
+    from matplotlib.axes import Axes
+    from matplotlib.figure import Figure
+
+WINDOW_RE = re.compile(r"^([1-9]\d*)([hdw])$")
+WINDOW_UNITS = {"h": 3600, "d": 86400, "w": 86400 * 7}
+# Longer windows cover the whole history anyway and overflow datetime
+MAX_WINDOW = 20 * 365 * 86400
+
+# Chats with fewer messages are too small for statistics
+MIN_MESSAGES = 200
+MAX_SAMPLES = 5000
+# Telegram returns at most this many messages per `get_messages` request
+BATCH_SIZE = 100
+PARALLEL_BATCHES = 4
+# How many following IDs are probed to replace a deleted sample
+GAP_PROBE = 5
+REFINE_ROUNDS = 2
+# Cached first message is checked to still exist this often, in seconds
+FIRST_MSG_CHECK_INTERVAL = 86400
+# Cached samples of chats not looked at for this long are dropped, in seconds
+SAMPLES_CACHE_TTL = 30 * 86400
+SAMPLES_CACHE_CHATS = 50
+
+# Cached chat stats for msgcmp expire after this many seconds
+STATS_CACHE_TTL = 300
+COMPARE_CONCURRENCY = 4
+
+# Message id -> message date timestamp
+Samples = Dict[int, float]
+
+
+class MessageRef(NamedTuple):
+    """ID and date of a message, enough to calculate MpH"""
+
+    id: int
+    date: datetime
+
+
+class ChatStats(NamedTuple):
+    """Activity summary of a single chat"""
+
+    title: str
+    first_id: int
+    first_date: float
+    last_id: int
+    last_date: float
+    samples: Samples
+
+
+stats_cache: Dict[Union[int, str], Tuple[ChatStats, float]] = {}
+
+# Activity histograms scan the whole history of chats up to this size,
+# bigger chats are reservoir-sampled
+HISTOGRAM_MODES = ("hour", "weekday", "calendar")
+HISTOGRAM_FULL_SCAN = 20000
+HISTOGRAM_SAMPLES = 5000
+
+
+def reservoir_ids(count: int, k: int) -> List[int]:
+    """Uniformly sample `k` of IDs 1..`count`, reservoir sampling (algorithm L)"""
+    if count <= k:
+        return list(range(1, count + 1))
+
+    def rand() -> float:
+        return random.random() or 1e-300
+
+    reservoir = list(range(1, k + 1))
+    weight = math.exp(math.log(rand()) / k)
+    i = k
+    while True:
+        i += int(math.log(rand()) / math.log(1 - weight)) + 1
+        if i > count:
+            break
+
+        reservoir[random.randrange(k)] = i
+        weight *= math.exp(math.log(rand()) / k)
+
+    return sorted(reservoir)
+
+
+class ActivityHistogram:
+    """Message counts by hour of day, weekday and calendar day, UTC"""
+
+    def __init__(self):
+        self.hours = [0] * 24
+        self.weekdays = [0] * 7
+        # Days since the epoch -> count
+        self.days: Dict[int, int] = {}
+        self.count = 0
+
+    def add(self, timestamp: float):
+        """Count message sent at `timestamp`"""
+        date = time.gmtime(timestamp)
+        self.hours[date.tm_hour] += 1
+        self.weekdays[date.tm_wday] += 1
+        day = int(timestamp // 86400)
+        self.days[day] = self.days.get(day, 0) + 1
+        self.count += 1
+
+
+# Live tracker keeps a day of incoming message counts in 5-minute buckets
+LIVE_BUCKET = 300
+LIVE_BUCKETS = 288
+LIVE_MAX_SENDERS = 200
+# How often live tracker state is saved to the database, in seconds
+LIVE_PERSIST_INTERVAL = 300
+
+
+class LiveTracker:
+    """Counts incoming messages of a chat with bounded memory"""
+
+    def __init__(self, state: dict = None):
+        state = state or {}
+        # Index of the latest bucket, counted from the epoch
+        self.head = state.get("head", 0)
+        self.buckets = state.get("buckets", [0] * LIVE_BUCKETS)
+        # Weekday (Monday first) * 24 + hour of day, UTC
+        self.heatmap = state.get("heatmap", [0] * 7 * 24)
+        self.senders = {
+            int(sender_id): count
+            for sender_id, count in state.get("senders", {}).items()
+        }
+
+    def advance(self, bucket: int):
+        """Move the ring buffer head to `bucket`, zeroing skipped buckets"""
+        if bucket <= self.head:
+            return
+
+        for i in range(self.head + 1, min(bucket, self.head + LIVE_BUCKETS) + 1):
+            self.buckets[i % LIVE_BUCKETS] = 0
+
+        self.head = bucket
+
+    def add(self, timestamp: float, sender_id: Optional[int]):
+        """Count message sent at `timestamp` by `sender_id`"""
+        bucket = int(timestamp // LIVE_BUCKET)
+        self.advance(bucket)
+        if bucket > self.head - LIVE_BUCKETS:
+            self.buckets[bucket % LIVE_BUCKETS] += 1
+
+        date = time.gmtime(timestamp)
+        self.heatmap[date.tm_wday * 24 + date.tm_hour] += 1
+
+        if sender_id:
+            self.senders[sender_id] = self.senders.get(sender_id, 0) + 1
+            if len(self.senders) > LIVE_MAX_SENDERS:
+                self.senders = dict(self.top_senders(LIVE_MAX_SENDERS // 2))
+
+    def count(self, seconds: int) -> int:
+        """Get count of messages in last `seconds`"""
+        self.advance(int(time.time() // LIVE_BUCKET))
+        return sum(
+            self.buckets[i % LIVE_BUCKETS]
+            for i in range(
+                self.head - min(seconds // LIVE_BUCKET, LIVE_BUCKETS) + 1, self.head + 1
+            )
+        )
+
+    def top_senders(self, limit: int) -> List[Tuple[int, int]]:
+        """Get `limit` most active senders with their message counts"""
+        return sorted(self.senders.items(), key=lambda item: item[1], reverse=True)[
+            :limit
+        ]
+
+    def state(self) -> dict:
+        """Get state suitable for storing in the database"""
+        return {
+            "head": self.head,
+            "buckets": self.buckets,
+            "heatmap": self.heatmap,
+            "senders": self.senders,
+        }
+
+
+class ChartRenderer:
+    """Renders charts off the event loop, without pyplot global state"""
+
+    def __init__(self):
+        # Agg renderers share font objects, so charts are drawn one at a time
+        # on a dedicated thread, while any number of renders may be queued
+        self.executor = ThreadPoolExecutor(1, thread_name_prefix="msgrate-render")
+        self.local = threading.local()
+
+    def get_figure(self) -> "Figure":
+        """Get cleared figure of the current worker, reusing it between renders"""
+        if not hasattr(self.local, "figure"):
+            # Figure is bound to Agg canvas directly, so no GUI backend is ever
+            # selected and pyplot is never imported
+            # pylint: disable=import-outside-toplevel
+            from matplotlib.backends.backend_agg import FigureCanvasAgg
+            from matplotlib.figure import Figure
+
+            self.local.figure = Figure()
+            FigureCanvasAgg(self.local.figure)
+        else:
+            self.local.figure.clear()
+
+        return self.local.figure
+
+    def draw(self, plot: Callable[["Axes"], Any]) -> BytesIO:
+        """Draw chart with `plot` on a new axes and save it as PNG"""
+        figure = self.get_figure()
+        plot(figure.add_subplot())
+
+        stream = BytesIO()
+        figure.savefig(stream, format="png")
+        stream.seek(0)
+        return stream
+
+    async def render(self, plot: Callable[["Axes"], Any]) -> BytesIO:
+        """Render chart in the worker thread"""
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, self.draw, plot
+        )
+
+    def close(self):
+        """Stop the worker thread"""
+        self.executor.shutdown(wait=False)
+
 
 # noinspection PyCallingNonCallable,PyAttributeOutsideInit
 # pylint: disable=not-callable,attribute-defined-outside-init,invalid-name
@@ -43,33 +284,181 @@ class MsgRateMod(loader.Module):
         "channels_only": "🚫 <b>This command can be executed only in groups and channels</b>",
         "unable_first_msg": "🚫 <b>Unable to retrieve first message</b>",
         "mph_for": "🔢 <b>MpH for {title}: {count}</b>",
+        "mph_for_window": "🔢 <b>MpH for {title} over the last {window}: {count}</b>",
+        "window_too_long": "🚫 <b>Time window can't be longer than {max} weeks</b>",
         "chat_small": "🚫 <b>Messaging history of this chat is too small</b>",
         "calculating": "🕑 <b>Calculating, please wait..</b>",
         "messages_count": "Messages count",
         "average_mph": "Average messages per hour",
         "stats_for_chat": "MpH stats for chat {title}",
+        "cfg_samples": "Count of evenly spaced messages sampled for msgstat graph",
+        "cfg_refine_threshold": (
+            "Fetch extra samples between points whose MpH differs more than this"
+            " many times. 0 to disable"
+        ),
+        "cfg_smoothing": (
+            "Plot moving average of MpH over this many points. 0 to disable"
+        ),
+        "compare_usage": "🧐 <b>Specify at least two chats to compare</b>",
+        "compare_stats": "📊 <b>MpH comparison</b>\n\n{rows}",
+        "compare_row": (
+            "• <b>{title}</b>: <code>{mph}</code> MpH," " <code>{count}</code> messages"
+        ),
+        "compare_failed": "\n\n🚫 <b>Unable to get stats for:</b> {chats}",
+        "compare_chart": "MpH comparison",
+        "date": "Date",
+        "tracking_on": "👁 <b>Live tracking of incoming messages enabled for this chat</b>",
+        "tracking_off": "🙈 <b>Live tracking disabled for this chat</b>",
+        "not_tracked": (
+            "🚫 <b>This chat isn't tracked. Enable tracking with</b>"
+            " <code>.msgtrack</code>"
+        ),
+        "live_stats": (
+            "👁 <b>Live MpH for {title}</b>\n\n"
+            "🕐 <b>Last hour:</b> <code>{hour}</code>\n"
+            "📅 <b>Last 24 hours:</b> <code>{day}</code> MpH\n\n"
+            "🗣 <b>Top senders:</b>\n{senders}"
+        ),
+        "live_sender": "• <a href='tg://user?id={id}'>{id}</a>: <code>{count}</code>",
+        "heatmap_title": "Messages by hour of day (UTC)",
+        "hour": "Hour",
+        "messages": "Messages",
+        "week": "Week",
+        "activity_hour": "{title}: messages by hour of day (UTC)",
+        "activity_weekday": "{title}: messages by weekday",
+        "activity_calendar": "{title}: messages by day",
+        "activity_sampled": ("📊 <b>Estimated from {sampled} of {count} messages</b>"),
+        "activity_full": "📊 <b>Counted from {sampled} messages</b>",
+        "weekdays": "Mon Tue Wed Thu Fri Sat Sun",
+        "percentiles": (
+            "📊 <b>MpH percentiles over {count} samples:</b> p50 <code>{p50}</code>,"
+            " p90 <code>{p90}</code>, p99 <code>{p99}</code>, max <code>{max}</code>"
+        ),
     }
 
     strings_ru = {
         "_cls_doc": "Показывает активность чата в MpH (кол-во сообщений в час)",
-        "_cmd_doc_msgrate": "<айди чата/юзернейм/текущий> — Показать MpH чата",
-        "_cmd_doc_msgstat": "<r|g|b> <айди чата/юзернейм/текущий> — Показать статистику MpH чата",
+        "_cmd_doc_msgrate": (
+            "[24h/7d/2w] <айди чата/юзернейм/текущий> — Показать MpH чата"
+            " за всё время или за указанный период"
+        ),
+        "_cmd_doc_msgstat": (
+            "[hour|weekday|calendar] <айди чата/юзернейм/текущий> — Показать"
+            " статистику MpH чата или распределение сообщений по часам, дням недели"
+            " или дням"
+        ),
         "channels_only": "🚫 <b>Эта команда может быть выполнена только в группах и каналах</b>",
         "unable_first_msg": "🚫 <b>Не удаётся получить первое сообщение чата</b>",
         "mph_for": "🔢 <b>MpH для {title}: {count}</b>",
+        "mph_for_window": "🔢 <b>MpH для {title} за последние {window}: {count}</b>",
+        "window_too_long": "🚫 <b>Период не может быть длиннее {max} недель</b>",
         "chat_small": "🚫 <b>История сообщений этого чата слишком мала</b>",
         "calculating": "🕑 <b>Рассчитываем, пожалуйста, подождите..</b>",
         "messages_count": "Количество сообщений",
         "average_mph": "Среднее кол-во сообщений в час",
         "stats_for_chat": "Статистика MpH для чата {title}",
+        "cfg_samples": "Количество равномерно выбранных сообщений для графика msgstat",
+        "cfg_refine_threshold": (
+            "Запрашивать дополнительные сообщения между точками, MpH которых"
+            " отличается больше, чем во столько раз. 0 — отключить"
+        ),
+        "cfg_smoothing": (
+            "Рисовать скользящее среднее MpH по стольким точкам. 0 — отключить"
+        ),
+        "_cmd_doc_msgcmp": (
+            "<айди чата/юзернейм> <айди чата/юзернейм> ... — Сравнить MpH нескольких"
+            " чатов"
+        ),
+        "compare_usage": "🧐 <b>Укажи хотя бы два чата для сравнения</b>",
+        "compare_stats": "📊 <b>Сравнение MpH</b>\n\n{rows}",
+        "compare_row": (
+            "• <b>{title}</b>: <code>{mph}</code> MpH,"
+            " <code>{count}</code> сообщений"
+        ),
+        "compare_failed": "\n\n🚫 <b>Не удалось получить статистику для:</b> {chats}",
+        "compare_chart": "Сравнение MpH",
+        "date": "Дата",
+        "_cmd_doc_msgtrack": "Включить/выключить подсчёт входящих сообщений в этом чате",
+        "_cmd_doc_msglive": "Показать MpH чата по входящим сообщениям",
+        "tracking_on": "👁 <b>Подсчёт входящих сообщений в этом чате включён</b>",
+        "tracking_off": "🙈 <b>Подсчёт входящих сообщений в этом чате выключен</b>",
+        "not_tracked": (
+            "🚫 <b>Сообщения в этом чате не подсчитываются. Включи подсчёт командой</b>"
+            " <code>.msgtrack</code>"
+        ),
+        "live_stats": (
+            "👁 <b>MpH в реальном времени для {title}</b>\n\n"
+            "🕐 <b>За последний час:</b> <code>{hour}</code>\n"
+            "📅 <b>За последние 24 часа:</b> <code>{day}</code> MpH\n\n"
+            "🗣 <b>Самые активные:</b>\n{senders}"
+        ),
+        "live_sender": "• <a href='tg://user?id={id}'>{id}</a>: <code>{count}</code>",
+        "heatmap_title": "Сообщения по часам (UTC)",
+        "hour": "Час",
+        "messages": "Сообщения",
+        "week": "Неделя",
+        "activity_hour": "{title}: сообщения по часам (UTC)",
+        "activity_weekday": "{title}: сообщения по дням недели",
+        "activity_calendar": "{title}: сообщения по дням",
+        "activity_sampled": ("📊 <b>Оценка по {sampled} из {count} сообщений</b>"),
+        "activity_full": "📊 <b>Подсчитано по {sampled} сообщениям</b>",
+        "weekdays": "Пн Вт Ср Чт Пт Сб Вс",
+        "percentiles": (
+            "📊 <b>Перцентили MpH по {count} точкам:</b> p50 <code>{p50}</code>,"
+            " p90 <code>{p90}</code>, p99 <code>{p99}</code>, макс. <code>{max}</code>"
+        ),
     }
 
-    async def client_ready(self, client: TelegramClient, _):
+    def __init__(self):
+        self.config = loader.ModuleConfig(
+            "SAMPLES",
+            200,
+            lambda m: self.strings("cfg_samples", m),
+            "REFINE_THRESHOLD",
+            2.0,
+            lambda m: self.strings("cfg_refine_threshold", m),
+            "SMOOTHING",
+            0,
+            lambda m: self.strings("cfg_smoothing", m),
+        )
+
+    async def client_ready(self, client: TelegramClient, db):
         """client_ready hook"""
         self.client = client
+        self.db = db
+        self.renderer = ChartRenderer()
+        self.trackers = {
+            int(chat_id): LiveTracker(state)
+            for chat_id, state in self.get("live", {}).items()
+        }
+        self.next_persist = time.time() + LIVE_PERSIST_INTERVAL
 
         await client(JoinChannelRequest(channel=self.strings("author")))
 
+    def on_unload(self):
+        """on_unload hook"""
+        self.renderer.close()
+        self.persist_trackers()
+
+    def persist_trackers(self):
+        """Save live trackers state to the database"""
+        self.next_persist = time.time() + LIVE_PERSIST_INTERVAL
+        self.set(
+            "live",
+            {
+                str(chat_id): tracker.state()
+                for chat_id, tracker in self.trackers.items()
+            },
+        )
+
+    def get(self, key: str, default: Any = None):
+        """Get value from database"""
+        return self.db.get(self.strings("name"), key, default)
+
+    def set(self, key: str, value: Any):
+        """Set value in database"""
+        return self.db.set(self.strings("name"), key, value)
+
     @staticmethod
     def calc_mph(msg1: Message, msg2: Message) -> float:
         """Calculates MpH value for range between two messages"""
@@ -78,10 +467,34 @@ class MsgRateMod(loader.Module):
 
         return round(count / (hours or 1), 3)
 
+    @staticmethod
+    def get_window(message: Message) -> Optional[str]:
+        """Get time window argument (e.g. `24h`, `7d`) from given message"""
+        return next(
+            (arg for arg in utils.get_args(message) if WINDOW_RE.match(arg)), None
+        )
+
+    @staticmethod
+    def window_to_seconds(window: str) -> int:
+        """Convert time window like `24h` to seconds"""
+        count, unit = WINDOW_RE.match(window).groups()
+        return int(count) * WINDOW_UNITS[unit]
+
+    @staticmethod
+    def get_mode(message: Message) -> Optional[str]:
+        """Get histogram mode argument (e.g. `hour`) from given message"""
+        return next(
+            (arg for arg in utils.get_args(message) if arg in HISTOGRAM_MODES), None
+        )
+
     @staticmethod
     def get_chat_id(message: Message) -> int:
         """Get chat_id from given message"""
-        args = utils.get_args(message)
+        args = [
+            arg
+            for arg in utils.get_args(message)
+            if not WINDOW_RE.match(arg) and arg not in HISTOGRAM_MODES
+        ]
         if args and len(args[-1]) > 3:
             chat_id = args[-1]
             with suppress(ValueError):
@@ -97,80 +510,623 @@ class MsgRateMod(loader.Module):
         """Gets last or first message in chat"""
         return self.client.iter_messages(chat_id, limit=1, reverse=reverse).__anext__()
 
+    async def get_first_msg(
+        self, chat_id: EntityLike, last_msg: Message
+    ) -> Union[Message, MessageRef]:
+        """Gets first message in chat, cached until history wipe is detected"""
+        key = str(last_msg.chat_id)
+        first_msgs = self.get("first_msgs", {})
+
+        if key in first_msgs:
+            msg_id, timestamp, *checked = first_msgs[key]
+            ref = MessageRef(msg_id, datetime.fromtimestamp(timestamp, timezone.utc))
+            if time.time() - (checked[0] if checked else 0) < FIRST_MSG_CHECK_INTERVAL:
+                return ref
+
+            # IDs keep growing after history is cleared, so only a lookup of
+            # the cached message itself tells whether it's gone
+            msg = await self.client.get_messages(chat_id, ids=msg_id)
+            if msg and not isinstance(msg, MessageEmpty):
+                first_msgs[key] = [msg_id, timestamp, time.time()]
+                self.set("first_msgs", first_msgs)
+                return ref
+
+        first_msg = await self.get_last_msg(chat_id, reverse=True)
+        first_msgs[key] = [first_msg.id, first_msg.date.timestamp(), time.time()]
+        self.set("first_msgs", first_msgs)
+
+        return first_msg
+
+    async def get_title(self, msg: Message) -> str:
+        """Gets title of message chat, cached in the database"""
+        key = str(msg.chat_id)
+        titles = self.get("titles", {})
+
+        if msg.chat is not None:
+            # Entity came along with the message, so no request is needed
+            title = msg.chat.title
+        elif key in titles:
+            return titles[key]
+        else:
+            title = (await msg.get_chat()).title
+
+        if titles.get(key) != title:
+            titles[key] = title
+            self.set("titles", titles)
+
+        return title
+
+    async def get_msg_after(
+        self, chat_id: EntityLike, date: datetime
+    ) -> Optional[Message]:
+        """Gets first message sent after `date` in a single request"""
+        messages = await self.client.get_messages(
+            chat_id, limit=1, offset_date=date, reverse=True
+        )
+        return messages[0] if messages else None
+
+    async def fetch_samples(self, chat_id: EntityLike, ids: List[int]) -> Samples:
+        """Fetch messages `ids` in parallel batches, skipping deleted ones"""
+        semaphore = asyncio.Semaphore(PARALLEL_BATCHES)
+
+        async def fetch(batch: List[int]) -> List[Message]:
+            async with semaphore:
+                return await self.client.get_messages(chat_id, ids=batch)
+
+        batches = await asyncio.gather(
+            *(fetch(ids[i : i + BATCH_SIZE]) for i in range(0, len(ids), BATCH_SIZE))
+        )
+
+        return {
+            msg.id: msg.date.timestamp()
+            for batch in batches
+            for msg in batch
+            if msg and not isinstance(msg, MessageEmpty)
+        }
+
+    async def fill_gaps(
+        self, chat_id: EntityLike, samples: Samples, missing: List[int]
+    ):
+        """Replace deleted samples with the nearest following messages"""
+        probes = {
+            probe: sample_id
+            for sample_id in missing
+            for probe in range(sample_id + 1, sample_id + GAP_PROBE + 1)
+            if probe not in samples
+        }
+        found = await self.fetch_samples(chat_id, list(probes))
+
+        filled = set()
+        for msg_id in sorted(found):
+            if probes[msg_id] not in filled:
+                filled.add(probes[msg_id])
+                samples[msg_id] = found[msg_id]
+
+    @staticmethod
+    def sample_arrays(samples: Samples) -> Tuple["np.ndarray", "np.ndarray"]:
+        """Convert samples to sorted arrays of message IDs and timestamps"""
+        import numpy as np  # pylint: disable=import-outside-toplevel
+
+        ids = np.fromiter(sorted(samples), dtype=np.int64, count=len(samples))
+        dates = np.fromiter(
+            (samples[msg_id] for msg_id in ids.tolist()),
+            dtype=np.float64,
+            count=len(ids),
+        )
+        return ids, dates
+
+    @staticmethod
+    def calc_rates(ids: "np.ndarray", dates: "np.ndarray") -> "np.ndarray":
+        """Get MpH between each pair of adjacent samples"""
+        import numpy as np  # pylint: disable=import-outside-toplevel
+
+        if len(ids) < 2:
+            return np.empty(0)
+
+        hours = np.diff(dates) / 3600
+        hours[hours == 0] = 1
+        return np.round(np.diff(ids) / hours, 3)
+
+    @staticmethod
+    def rolling_mean(values: "np.ndarray", window: int) -> "np.ndarray":
+        """Get moving average of `values` over `window` points"""
+        import numpy as np  # pylint: disable=import-outside-toplevel
+
+        if window <= 1 or len(values) < window:
+            return values
+
+        cumsum = np.cumsum(np.insert(values, 0, 0.0))
+        return (cumsum[window:] - cumsum[:-window]) / window
+
+    @staticmethod
+    def percentiles(values: "np.ndarray", q: List[float]) -> List[float]:
+        """Get `q` percentiles of `values`"""
+        import numpy as np  # pylint: disable=import-outside-toplevel
+
+        if not len(values):
+            return [0.0] * len(q)
+
+        return np.percentile(values, q).tolist()
+
+    def refine_ids(
+        self, samples: Samples, threshold: float, budget: int, start_id: int = 0
+    ) -> List[int]:
+        """Get midpoint IDs after `start_id` around samples where MpH changes sharply"""
+        import numpy as np  # pylint: disable=import-outside-toplevel
+
+        ids, dates = self.sample_arrays(samples)
+        rates = self.calc_rates(ids, dates)
+        if len(rates) < 2:
+            return []
+
+        lower = np.maximum(np.minimum(rates[:-1], rates[1:]), 1e-3)
+        sharp = np.flatnonzero(np.maximum(rates[:-1], rates[1:]) > threshold * lower)
+        segments = np.unique(np.concatenate([sharp, sharp + 1]))
+
+        first, second = ids[segments], ids[segments + 1]
+        mask = (second - first > 1) & (second > start_id)
+
+        return np.unique((first[mask] + second[mask]) // 2)[:budget].tolist()
+
+    async def sample_messages(
+        self, chat_id: EntityLike, last_id: int, count: int, cached: Samples = None
+    ) -> Samples:
+        """
+        Get `count` evenly spaced samples, refined where MpH changes sharply.
+        Only IDs after the last `cached` sample are fetched
+        """
+        samples = dict(cached or {})
+        start_id = max(samples, default=0)
+
+        step = max(last_id // count, 1)
+        ids = [step * i + 1 for i in range(count) if step * i + 1 > start_id]
+        if last_id not in ids and last_id > start_id:
+            ids.append(last_id)
+
+        samples.update(await self.fetch_samples(chat_id, ids))
+        if missing := [msg_id for msg_id in ids if msg_id not in samples]:
+            await self.fill_gaps(chat_id, samples, missing)
+
+        threshold = float(self.config["REFINE_THRESHOLD"])
+        for _ in range(REFINE_ROUNDS if threshold > 0 else 0):
+            budget = max(MAX_SAMPLES - len(samples), 0)
+            refine = self.refine_ids(samples, threshold, budget, start_id)
+            if not refine:
+                break
+
+            samples.update(await self.fetch_samples(chat_id, refine))
+
+        return samples
+
+    def get_cached_samples(self, chat_id: int, last_id: int, count: int) -> Samples:
+        """Get cached samples for chat, unless they are sparser than requested"""
+        entry = self.get("samples", {}).get(str(chat_id))
+        if not entry or not entry["points"]:
+            return {}
+
+        samples = {msg_id: date for msg_id, date in entry["points"]}
+        if max(samples) > last_id:
+            # History was cleared or chat was recreated
+            return {}
+
+        if len(samples) < count * max(samples) / last_id / 2:
+            return {}
+
+        return samples
+
+    def cache_samples(self, chat_id: int, samples: Samples):
+        """Store samples for chat and evict stale entries"""
+        # Thinned to at most twice the configured count, which is still dense
+        # enough for `get_cached_samples` and keeps the database small
+        limit = 2 * max(int(self.config["SAMPLES"]), 2)
+        points = sorted(samples.items())
+        while len(points) > limit:
+            points = points[:-1:2] + points[-1:]
+
+        cache = self.get("samples", {})
+        cache[str(chat_id)] = {"used": time.time(), "points": points}
+
+        now = time.time()
+        fresh = sorted(
+            (
+                (key, entry)
+                for key, entry in cache.items()
+                if now - entry["used"] < SAMPLES_CACHE_TTL
+            ),
+            key=lambda item: item[1]["used"],
+            reverse=True,
+        )
+        self.set("samples", dict(fresh[:SAMPLES_CACHE_CHATS]))
+
+    def get_samples_count(self, last_id: int) -> int:
+        """Get configured count of samples, capped by chat size"""
+        return min(max(int(self.config["SAMPLES"]), 2), MAX_SAMPLES, last_id)
+
+    async def get_chat_stats(self, chat_id: EntityLike) -> ChatStats:
+        """Get activity summary of chat, reusing recent results"""
+        if chat_id in stats_cache and stats_cache[chat_id][1] > time.perf_counter():
+            return stats_cache[chat_id][0]
+
+        last_msg = await self.get_last_msg(chat_id)
+        if not last_msg.is_channel:
+            raise ValueError("chat is not a group or a channel")
+
+        first_msg = await self.get_first_msg(chat_id, last_msg)
+
+        samples = {}
+        if last_msg.id > MIN_MESSAGES:
+            count = self.get_samples_count(last_msg.id)
+            samples = await self.sample_messages(
+                chat_id,
+                last_msg.id,
+                count,
+                self.get_cached_samples(last_msg.chat_id, last_msg.id, count),
+            )
+            self.cache_samples(last_msg.chat_id, samples)
+
+        stats = ChatStats(
+            title=await self.get_title(last_msg),
+            first_id=first_msg.id,
+            first_date=first_msg.date.timestamp(),
+            last_id=last_msg.id,
+            last_date=last_msg.date.timestamp(),
+            samples=samples,
+        )
+        stats_cache[chat_id] = (stats, time.perf_counter() + STATS_CACHE_TTL)
+
+        return stats
+
     async def msgratecmd(self, message: Message):
-        """<chat id/username/current> — Show MpH for chat"""
+        """[24h/7d/2w] <chat id/username/current> — Show MpH for chat, optionally over time window"""
         chat_id = self.get_chat_id(message)
         last_msg = await self.get_last_msg(chat_id)
 
         if not last_msg.is_channel:
             return await utils.answer(message, self.strings("channels_only"))
 
+        if window := self.get_window(message):
+            seconds = self.window_to_seconds(window)
+            if seconds > MAX_WINDOW:
+                return await utils.answer(
+                    message,
+                    self.strings("window_too_long").format(
+                        max=MAX_WINDOW // WINDOW_UNITS["w"]
+                    ),
+                )
+
+            first_msg = await self.get_msg_after(
+                chat_id, datetime.now(timezone.utc) - timedelta(seconds=seconds)
+            )
+            count = last_msg.id - first_msg.id + 1 if first_msg else 0
+
+            return await utils.answer(
+                message,
+                self.strings("mph_for_window").format(
+                    title=await self.get_title(last_msg),
+                    window=window,
+                    count=round(count / (seconds / 3600), 3),
+                ),
+            )
+
         if (reply := await message.get_reply_message()) and chat_id == message.chat_id:
             msg = reply
         else:
-            msg = await self.get_last_msg(chat_id, reverse=True)
+            msg = await self.get_first_msg(chat_id, last_msg)
 
         await utils.answer(
             message,
             self.strings("mph_for").format(
-                title=(await last_msg.get_chat()).title,
+                title=await self.get_title(last_msg),
                 count=self.calc_mph(msg, last_msg),
             ),
         )
 
+    async def collect_activity(
+        self, chat_id: EntityLike, ids: List[int]
+    ) -> ActivityHistogram:
+        """Count messages `ids` in a streaming pass, a few batches at a time"""
+        histogram = ActivityHistogram()
+        chunk = BATCH_SIZE * PARALLEL_BATCHES
+
+        for i in range(0, len(ids), chunk):
+            for timestamp in (
+                await self.fetch_samples(chat_id, ids[i : i + chunk])
+            ).values():
+                histogram.add(timestamp)
+
+        return histogram
+
+    async def send_activity(
+        self, message: Message, chat_id: EntityLike, last_msg: Message, mode: str
+    ):
+        """Send activity histogram of chat in given `mode`"""
+        if last_msg.id <= HISTOGRAM_FULL_SCAN:
+            ids = list(range(1, last_msg.id + 1))
+        else:
+            ids = reservoir_ids(last_msg.id, HISTOGRAM_SAMPLES)
+
+        histogram = await self.collect_activity(chat_id, ids)
+        # Sampled counts are scaled to the estimated count of messages
+        scale = last_msg.id / len(ids)
+
+        title = self.strings(f"activity_{mode}").format(
+            title=await self.get_title(last_msg)
+        )
+        ylabel = self.strings("messages")
+        weekdays = self.strings("weekdays").split()
+
+        if mode == "hour":
+            xlabel = self.strings("hour")
+            values = [count * scale for count in histogram.hours]
+
+            def plot(ax: "Axes"):
+                ax.set_title(title)
+                ax.set_xlabel(xlabel)
+                ax.set_ylabel(ylabel)
+                ax.bar(range(24), values, color="r")
+                ax.set_xticks(range(0, 24, 2))
+
+        elif mode == "weekday":
+            values = [count * scale for count in histogram.weekdays]
+
+            def plot(ax: "Axes"):
+                ax.set_title(title)
+                ax.set_ylabel(ylabel)
+                ax.bar(weekdays, values, color="r")
+
+        else:
+            xlabel = self.strings("week")
+            first_day = min(histogram.days, default=0)
+            # Epoch day 0 is Thursday, so weeks are aligned to start on Monday
+            first_monday = first_day - (first_day + 3) % 7
+            weeks = (max(histogram.days, default=0) - first_monday) // 7 + 1
+            grid = [[math.nan] * weeks for _ in range(7)]
+            for day, count in histogram.days.items():
+                grid[(day + 3) % 7][(day - first_monday) // 7] = count * scale
+
+            def plot(ax: "Axes"):
+                ax.set_title(title)
+                ax.set_xlabel(xlabel)
+                image = ax.imshow(grid, cmap="Reds", aspect="auto")
+                ax.set_yticks(range(7))
+                ax.set_yticklabels(weekdays)
+                ax.figure.colorbar(image, ax=ax, label=ylabel)
+
+        stream = await self.renderer.render(plot)
+        stream.name = f"{mode}.png"
+
+        caption = (
+            self.strings("activity_full").format(sampled=histogram.count)
+            if scale == 1
+            else self.strings("activity_sampled").format(
+                sampled=histogram.count, count=last_msg.id
+            )
+        )
+        await self.client.send_file(
+            message.chat_id,
+            stream,
+            caption=caption,
+            reply_to=message.reply_to_msg_id,
+        )
+
     async def msgstatcmd(self, message: Message):
-        """<r|g|b> <chat id/username/current> — Show chat MpH statistics"""
+        """[hour|weekday|calendar] <chat id/username/current> — Show chat MpH statistics or messages distribution by hour, weekday or day"""
         chat_id = self.get_chat_id(message)
         last_msg = await self.get_last_msg(chat_id)
 
         if not last_msg.is_channel:
             return await utils.answer(message, self.strings("channels_only"))
 
-        if last_msg.id <= 200:
+        if last_msg.id <= MIN_MESSAGES:
             return await utils.answer(message, self.strings("chat_small"))
 
         m = await utils.answer(message, self.strings("calculating"))
         if isinstance(m, list):
             m = m[0]
 
-        messages = list(
-            filter(
-                lambda msg: msg and not isinstance(msg, MessageEmpty),
-                await self.client.get_messages(
-                    chat_id,
-                    ids=[int(last_msg.id / 200) * count + 1 for count in range(200)],
-                ),
-            )
+        if mode := self.get_mode(message):
+            await self.send_activity(message, chat_id, last_msg, mode)
+            return await m.delete()
+
+        count = self.get_samples_count(last_msg.id)
+        samples = await self.sample_messages(
+            chat_id,
+            last_msg.id,
+            count,
+            self.get_cached_samples(last_msg.chat_id, last_msg.id, count),
         )
+        self.cache_samples(last_msg.chat_id, samples)
+        # Early history of a supergroup may be deleted, leaving almost nothing
+        if len(samples) < 2:
+            return await utils.answer(m, self.strings("chat_small"))
 
-        fig = plt.figure()
+        ids, dates = self.sample_arrays(samples)
+        rates = self.calc_rates(ids, dates)
+        p50, p90, p99 = self.percentiles(rates, [50, 90, 99])
 
-        x = [msg.id for msg in messages[:-1]]
-        y = [
-            self.calc_mph(first, second)
-            for first, second
-            in zip(messages, messages[1:])
-        ]
+        window = int(self.config["SMOOTHING"])
+        smoothed = (
+            self.rolling_mean(rates, window) if len(rates) >= window > 1 else None
+        )
+        xlabel, ylabel = self.strings("messages_count"), self.strings("average_mph")
+        title = self.strings("stats_for_chat").format(
+            title=await self.get_title(last_msg)
+        )
 
-        plt.xlabel(self.strings("messages_count"))
-        plt.ylabel(self.strings("average_mph"))
-        plt.plot(x, y, "r")
+        def plot(ax: "Axes"):
+            ax.set_xlabel(xlabel)
+            ax.set_ylabel(ylabel)
+            ax.set_title(title)
 
-        plt.title(
-            self.strings("stats_for_chat").format(
-                title=(await last_msg.get_chat()).title
-            )
-        )
+            if smoothed is not None:
+                ax.plot(ids[:-1], rates, "r", alpha=0.3)
+                ax.plot(ids[window - 1 : -1], smoothed, "r")
+            else:
+                ax.plot(ids[:-1], rates, "r")
 
-        stream = BytesIO()
+        stream = await self.renderer.render(plot)
         stream.name = "stats.png"
-        await utils.run_sync(plt.savefig, stream)
-        stream.seek(0)
-        plt.close(fig)
 
         await self.client.send_file(
             message.chat_id,
             stream,
+            caption=self.strings("percentiles").format(
+                p50=round(p50, 3),
+                p90=round(p90, 3),
+                p99=round(p99, 3),
+                max=round(float(rates.max()), 3),
+                count=len(ids),
+            ),
             reply_to=message.reply_to_msg_id,
         )
         await m.delete()
+
+    async def msgcmpcmd(self, message: Message):
+        """<chat id/username> <chat id/username> ... — Compare MpH of several chats"""
+        chats = []
+        for arg in utils.get_args(message):
+            with suppress(ValueError):
+                arg = int(arg)
+            chats.append(arg)
+
+        if len(chats) < 2:
+            return await utils.answer(message, self.strings("compare_usage"))
+
+        m = await utils.answer(message, self.strings("calculating"))
+        if isinstance(m, list):
+            m = m[0]
+
+        semaphore = asyncio.Semaphore(COMPARE_CONCURRENCY)
+
+        async def get_stats(chat_id: EntityLike) -> Optional[ChatStats]:
+            async with semaphore:
+                try:
+                    return await self.get_chat_stats(chat_id)
+                except (ValueError, StopAsyncIteration, RPCError):
+                    return None
+
+        results = await asyncio.gather(*(get_stats(chat_id) for chat_id in chats))
+        stats = [chat_stats for chat_stats in results if chat_stats]
+
+        rows = [
+            self.strings("compare_row").format(
+                title=utils.escape_html(chat_stats.title),
+                mph=round(
+                    (chat_stats.last_id - chat_stats.first_id)
+                    / ((chat_stats.last_date - chat_stats.first_date) / 3600 or 1),
+                    3,
+                ),
+                count=chat_stats.last_id - chat_stats.first_id + 1,
+            )
+            for chat_stats in sorted(
+                stats, key=lambda chat_stats: chat_stats.last_id, reverse=True
+            )
+        ]
+        text = self.strings("compare_stats").format(rows="\n".join(rows))
+        if failed := [
+            f"<code>{utils.escape_html(str(chat_id))}</code>"
+            for chat_id, chat_stats in zip(chats, results)
+            if not chat_stats
+        ]:
+            text += self.strings("compare_failed").format(chats=", ".join(failed))
+
+        lines = []
+        for chat_stats in stats:
+            if len(chat_stats.samples) < 2:
+                continue
+
+            ids, dates = self.sample_arrays(chat_stats.samples)
+            lines.append(
+                (
+                    chat_stats.title,
+                    dates[:-1].astype("datetime64[s]"),
+                    self.calc_rates(ids, dates),
+                )
+            )
+
+        await utils.answer(m, text)
+        if not lines:
+            return
+
+        xlabel, ylabel = self.strings("date"), self.strings("average_mph")
+        title = self.strings("compare_chart")
+
+        def plot(ax: "Axes"):
+            ax.set_xlabel(xlabel)
+            ax.set_ylabel(ylabel)
+            ax.set_title(title)
+
+            for label, x, y in lines:
+                ax.plot(x, y, label=label)
+
+            ax.legend()
+            ax.tick_params(axis="x", labelrotation=30)
+
+        stream = await self.renderer.render(plot)
+        stream.name = "compare.png"
+
+        await self.client.send_file(
+            message.chat_id, stream, reply_to=message.reply_to_msg_id
+        )
+
+    async def msgtrackcmd(self, message: Message):
+        """Toggle live tracking of incoming messages in this chat"""
+        if message.chat_id in self.trackers:
+            self.trackers.pop(message.chat_id)
+            self.persist_trackers()
+            return await utils.answer(message, self.strings("tracking_off"))
+
+        self.trackers[message.chat_id] = LiveTracker()
+        self.persist_trackers()
+        await utils.answer(message, self.strings("tracking_on"))
+
+    async def msglivecmd(self, message: Message):
+        """Show chat MpH counted from incoming messages"""
+        tracker = self.trackers.get(message.chat_id)
+        if not tracker:
+            return await utils.answer(message, self.strings("not_tracked"))
+
+        chat = await message.get_chat()
+        senders = "\n".join(
+            self.strings("live_sender").format(id=sender_id, count=count)
+            for sender_id, count in tracker.top_senders(10)
+        )
+        await utils.answer(
+            message,
+            self.strings("live_stats").format(
+                title=utils.escape_html(getattr(chat, "title", chat.id)),
+                hour=tracker.count(3600),
+                day=round(tracker.count(86400) / 24, 3),
+                senders=senders or "—",
+            ),
+        )
+
+        heatmap = [tracker.heatmap[day * 24 : day * 24 + 24] for day in range(7)]
+        title, xlabel = self.strings("heatmap_title"), self.strings("hour")
+        weekdays = self.strings("weekdays").split()
+
+        def plot(ax: "Axes"):
+            ax.set_title(title)
+            ax.set_xlabel(xlabel)
+            image = ax.imshow(heatmap, cmap="Reds", aspect="auto")
+            ax.set_xticks(range(0, 24, 2))
+            ax.set_yticks(range(7))
+            ax.set_yticklabels(weekdays)
+            ax.figure.colorbar(image, ax=ax)
+
+        stream = await self.renderer.render(plot)
+        stream.name = "heatmap.png"
+
+        await self.client.send_file(
+            message.chat_id, stream, reply_to=message.reply_to_msg_id
+        )
+
+    async def watcher(self, message: Message):
+        """Counts incoming messages in tracked chats"""
+        if not isinstance(message, Message) or message.chat_id not in self.trackers:
+            return
+
+        self.trackers[message.chat_id].add(message.date.timestamp(), message.sender_id)
+
+        if time.time() >= self.next_persist:
+            self.persist_trackers()
@@ -15,18 +15,355 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 # meta developer: @nalinormods
-# requires: speedtest-cli
+# requires: speedtest-cli matplotlib
 
-from typing import Tuple
+import asyncio
+import functools
+import json
+import logging
+import re
+import struct
+import sys
+import threading
+import time
+from contextlib import suppress
+from datetime import datetime
+from io import BytesIO
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Awaitable,
+    BinaryIO,
+    Callable,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+)
 
 from telethon import TelegramClient
+from telethon.errors.rpcerrorlist import MessageNotModifiedError
 from telethon.tl.custom import Message
 from telethon.tl.functions.channels import JoinChannelRequest
 
-import speedtest  # pylint: disable=import-self
-
 from .. import loader, utils
 
+if TYPE_CHECKING:
+    import speedtest
+
+logger = logging.getLogger(__name__)
+
+WINDOW_RE = re.compile(r"^(\d+)([hdw])$")
+WINDOW_UNITS = {"h": 3600, "d": 86400, "w": 86400 * 7}
+
+# Results history, a week of tests every 5 minutes
+HISTORY_FILE = "speedtest_history.bin"
+HISTORY_SIZE = 2016
+# Scheduler wakes up at least this often to pick up config changes, in seconds
+SCHEDULER_TICK = 60
+
+# Test is stopped if it takes longer than this, in seconds
+TEST_TIMEOUT = 120
+# Progress message is edited at most this often, in seconds
+EDIT_INTERVAL = 2
+# Worker process gets this long to stop gracefully before it's killed
+PROCESS_STOP_TIMEOUT = 5
+
+
+class Result(NamedTuple):
+    """Speedtest result, speeds are in bit/s and ping is in ms"""
+
+    timestamp: float
+    download: float
+    upload: float
+    ping: float
+    server: str
+
+
+class SpeedtestError(Exception):
+    """Raised when speedtest fails"""
+
+
+class SpeedtestCancelled(SpeedtestError):
+    """Raised when speedtest is cancelled"""
+
+
+class History:
+    """
+    Fixed-size ring buffer of results in a binary file.
+    Appending a result rewrites only its record and the header
+    """
+
+    # magic, version, capacity, number of results ever appended
+    HEADER = struct.Struct("<4sHIQ")
+    # timestamp, download, upload, ping, server name
+    RECORD = struct.Struct("<dfff32s")
+    MAGIC = b"SPDT"
+    VERSION = 1
+
+    def __init__(self, path: str, capacity: int = HISTORY_SIZE):
+        self.path = path
+        self.capacity = capacity
+
+    def read_total(self, file: BinaryIO) -> int:
+        """Read number of appended results, 0 if file isn't a valid history"""
+        data = file.read(self.HEADER.size)
+        if len(data) == self.HEADER.size:
+            magic, version, capacity, total = self.HEADER.unpack(data)
+            if (magic, version, capacity) == (self.MAGIC, self.VERSION, self.capacity):
+                return total
+
+        return 0
+
+    def append(self, result: Result):
+        """Write result over the oldest one"""
+        try:
+            file = open(self.path, "r+b")  # pylint: disable=consider-using-with
+        except FileNotFoundError:
+            file = open(self.path, "w+b")  # pylint: disable=consider-using-with
+
+        with file:
+            total = self.read_total(file)
+            file.seek(self.HEADER.size + total % self.capacity * self.RECORD.size)
+            file.write(
+                self.RECORD.pack(
+                    result.timestamp,
+                    result.download,
+                    result.upload,
+                    result.ping,
+                    result.server.encode()[:32],
+                )
+            )
+            file.seek(0)
+            file.write(
+                self.HEADER.pack(self.MAGIC, self.VERSION, self.capacity, total + 1)
+            )
+
+    def read(self) -> List[Result]:
+        """Get stored results, oldest first"""
+        try:
+            with open(self.path, "rb") as file:
+                total = self.read_total(file)
+                data = file.read(self.RECORD.size * min(total, self.capacity))
+        except FileNotFoundError:
+            return []
+
+        results = [
+            Result(
+                timestamp,
+                download,
+                upload,
+                ping,
+                server.rstrip(b"\0").decode(errors="ignore"),
+            )
+            for timestamp, download, upload, ping, server in self.RECORD.iter_unpack(
+                data[: len(data) // self.RECORD.size * self.RECORD.size]
+            )
+        ]
+        # The oldest result is the one to be overwritten next
+        start = total % self.capacity
+        return results[start:] + results[:start]
+
+
+# Speedtest worker. It's kept as source, so the same code runs in a thread
+# and, with SUBPROCESS, in a separate interpreter, and may only use names it
+# imports or defines itself
+WORKER_SOURCE = '''
+import threading
+import time
+from contextlib import suppress
+from typing import Any, Callable
+
+# Cached best server is re-validated when its ping grows this many times
+PING_DEGRADATION = 1.5
+
+
+def select_server(
+    s: "speedtest.Speedtest", servers: dict, pinned_id: int, ttl: float
+) -> dict:
+    """
+    Choose server for speedtest `s`, reusing the cached choice from `servers`.
+    Only its ping is measured, the shortlist is probed when it has degraded
+    and full discovery runs when both are slow or the cache has expired.
+    Returns updated cache
+    """
+    # pylint: disable=import-self,import-outside-toplevel
+    from speedtest import SpeedtestException
+
+    best = servers.get("best")
+    if pinned_id:
+        if best and servers.get("pinned") and best["id"] == str(pinned_id):
+            best = s.get_best_server([best])
+        else:
+            s.get_servers([pinned_id])
+            best = s.get_best_server()
+        return {"best": best, "pinned": True}
+
+    if best and not servers.get("pinned") and time.time() < servers["expires"]:
+        baseline = servers["latency"] * PING_DEGRADATION
+        with suppress(SpeedtestException):
+            if s.get_best_server([best])["latency"] <= baseline:
+                return servers
+            best = s.get_best_server(servers["shortlist"])
+            if best["latency"] <= baseline:
+                return {**servers, "best": best}
+
+    s.get_servers()
+    best = s.get_best_server()
+    return {
+        "best": best,
+        "shortlist": s.closest,
+        "latency": best["latency"],
+        "expires": time.time() + ttl,
+    }
+
+
+def speedtest_worker(
+    emit: Callable[[str, dict], Any],
+    shutdown_event: threading.Event,
+    settings: dict,
+):
+    """
+    Run speedtest, reporting progress with `emit(event, data)`:
+    "ping", "progress", "download" and "upload" as soon as they're known,
+    "error" if the test fails and always "end" as the last one.
+    Test stops early once `shutdown_event` is set. Doesn't touch module
+    state besides `select_server`, so it can run in any thread.
+
+    `settings` keys are "servers", "pinned_id" and "ttl" for `select_server`,
+    "ping_only", "threads" (0 for defaults), "download_sizes" and
+    "upload_sizes" (empty for defaults) and "target", an upload URL of
+    a speedtest.net-compatible server to test instead of speedtest.net ones
+    """
+    # Imported on first use to keep module load cheap
+    # pylint: disable=import-self,import-outside-toplevel,broad-except,no-member
+    from urllib.parse import urlparse
+
+    import speedtest
+
+    class TargetSpeedtest(speedtest.Speedtest):
+        """Speedtest of a single server, without speedtest.net config"""
+
+        def get_config(self):
+            self.config.update(
+                {
+                    "client": {},
+                    "ignore_servers": [],
+                    "sizes": {
+                        "download": [350, 500, 750, 1000, 1500, 2000],
+                        "upload": [131072, 262144, 524288, 1048576],
+                    },
+                    "counts": {"download": 4, "upload": 5},
+                    "threads": {"download": 4, "upload": 4},
+                    "length": {"download": 10, "upload": 10},
+                    "upload_max": 20,
+                }
+            )
+
+    def progress(stage: str) -> Callable:
+        def callback(i: int, total: int, end: bool = False, **_):
+            if end:
+                emit("progress", {"stage": stage, "progress": (i + 1) / total})
+
+        return callback
+
+    try:
+        target = settings.get("target")
+        if target:
+            s = TargetSpeedtest(shutdown_event=shutdown_event)
+            s.get_best_server(
+                [
+                    {
+                        "id": "0",
+                        "url": target,
+                        "sponsor": urlparse(target).netloc,
+                        "name": "custom",
+                    }
+                ]
+            )
+            # speedtest-cli counts failed latency probes as 3600 s
+            if s.results.ping >= 3600 * 1000 / 2:
+                raise speedtest.SpeedtestBestServerFailure(f"{target} is unreachable")
+            ping = {}
+        else:
+            s = speedtest.Speedtest(shutdown_event=shutdown_event)
+            ping = {
+                "servers": select_server(
+                    s, settings["servers"], settings["pinned_id"], settings["ttl"]
+                )
+            }
+
+        server = s.results.server
+        emit(
+            "ping",
+            {
+                "ping": s.results.ping,
+                "server": f"{server['sponsor']} ({server['name']})",
+                **ping,
+            },
+        )
+        if settings.get("ping_only"):
+            return
+
+        for stage in ("download", "upload"):
+            if settings.get(f"{stage}_sizes"):
+                s.config["sizes"][stage] = list(settings[f"{stage}_sizes"])
+        s.config["upload_max"] = (
+            len(s.config["sizes"]["upload"]) * s.config["counts"]["upload"]
+        )
+
+        threads = settings.get("threads") or None
+        for stage, run in (("download", s.download), ("upload", s.upload)):
+            run(callback=progress(stage), threads=threads)
+            if shutdown_event.is_set():
+                return
+            emit(stage, {stage: getattr(s.results, stage)})
+    except Exception as e:
+        emit("error", {"error": f"{type(e).__name__}: {e}"})
+    finally:
+        emit("end", {})
+'''
+
+# Entry point of the worker process: settings are read from stdin as JSON,
+# events are written to stdout as JSON lines, SIGTERM cancels the test
+WORKER_MAIN = """
+import json, signal, sys
+
+# Don't let a speedtest.py in the working directory shadow the library
+if sys.path and sys.path[0] == "":
+    del sys.path[0]
+
+shutdown_event = threading.Event()
+signal.signal(signal.SIGTERM, lambda *_: shutdown_event.set())
+
+
+def emit(event, data):
+    print(json.dumps([event, data]), flush=True)
+
+
+speedtest_worker(emit, shutdown_event, json.loads(sys.stdin.readline()))
+"""
+WORKER_SCRIPT = WORKER_SOURCE + WORKER_MAIN
+
+
+def load_worker() -> dict:
+    """Run worker source in a new namespace and return it"""
+    namespace = {"__name__": "speedtest_worker"}
+    # pylint: disable=exec-used
+    exec(compile(WORKER_SOURCE, "<speedtest worker>", "exec"), namespace)
+    return namespace
+
+
+worker_namespace = load_worker()
+select_server = worker_namespace["select_server"]
+speedtest_worker = worker_namespace["speedtest_worker"]
+
+
+def percentile(values: Sequence[float], q: float) -> float:
+    """Get `q`-th percentile of `values` by nearest rank"""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
 
 # noinspection PyCallingNonCallable,PyAttributeOutsideInit
 # pylint: disable=not-callable,attribute-defined-outside-init,invalid-name
@@ -43,43 +380,509 @@ class SpeedtestMod(loader.Module):
             "<b>⬆️ Upload: <code>{upload}</code> MBit/s</b>\n"
             "<b>🏓 Ping: <code>{ping}</code> ms</b>"
         ),
+        "no_history": "🤷‍♀️ <b>No speedtest results yet</b>",
+        "history": (
+            "📈 <b>Speedtest history, {count} tests</b>\n\n"
+            "<b>Latest one</b> (<code>{date}</code>, {server}):\n"
+            "{result}\n\n"
+            "<b>p5 / p50 / p95:</b>\n"
+            "<b>⬇️ <code>{download}</code> MBit/s</b>\n"
+            "<b>⬆️ <code>{upload}</code> MBit/s</b>\n"
+            "<b>🏓 <code>{ping}</code> ms</b>"
+        ),
+        "speed_chart": "Speed, MBit/s",
+        "ping_chart": "Ping, ms",
+        "download": "Download",
+        "upload": "Upload",
+        "progress_ping": "<b>🏓 Ping: <code>{ping}</code> ms</b> ({server})",
+        "progress_download": "<b>⬇️ Download: <code>{progress}%</code>...</b>",
+        "progress_upload": "<b>⬆️ Upload: <code>{progress}%</code>...</b>",
+        "done_download": "<b>⬇️ Download: <code>{speed}</code> MBit/s</b>",
+        "done_upload": "<b>⬆️ Upload: <code>{speed}</code> MBit/s</b>",
+        "cancelled": "🚫 <b>Speedtest was cancelled</b>",
+        "timeout": "⏰ <b>Speedtest took too long and was stopped</b>",
+        "failed": "🚫 <b>Speedtest failed:</b> <code>{error}</code>",
+        "cancelling": "🛑 <b>Cancelling speedtest...</b>",
+        "not_running": "🤷‍♀️ <b>Speedtest isn't running</b>",
+        "cfg_schedule_interval": "Run speedtest in background every N minutes, 0 to disable",
+        "cfg_history_file": "File where speedtest results are stored",
+        "cfg_server_cache_ttl": "How long the chosen server is reused, in hours",
+        "cfg_pinned_server": "ID of speedtest.net server to always use, 0 to choose automatically",
+        "cfg_threads": "Parallel connections per stage, 0 for speedtest.net defaults",
+        "cfg_single_stream": "Use one connection, to measure per-connection speed",
+        "cfg_download_sizes": "Download image sizes, like [350, 1000], empty for defaults",
+        "cfg_upload_sizes": "Upload payload sizes in bytes, empty for defaults",
+        "cfg_subprocess": "Run speedtest in a separate process, so it doesn't slow down the userbot",
+        "cfg_target_url": (
+            "Upload URL of your own speedtest.net-compatible server, "
+            "like http://10.0.0.2/speedtest/upload.php, empty to use speedtest.net"
+        ),
     }
 
     strings_ru = {
         "_cls_doc": "Проверяет скорость интернета на вашем сервере",
-        "_cmd_doc_speedtest": "Проверить скорость интернета",
+        "_cmd_doc_speedtest": "[ping] — Проверить скорость интернета или только пинг",
+        "_cmd_doc_speedtestcancel": "Отменить текущую проверку скорости",
+        "_cmd_doc_speedhistory": (
+            "[1h/1d/1w] — Показать историю проверок скорости за период"
+        ),
         "running": "🕑 <b>Проверяем скорость интернета...</b>",
         "result": (
             "<b>⬇️ Скачать: <code>{download}</code> МБит/с</b>\n"
             "<b>⬆️ Загрузить: <code>{upload}</code> МБит/с</b>\n"
             "<b>🏓 Пинг: <code>{ping}</code> мс</b>"
         ),
+        "no_history": "🤷‍♀️ <b>Проверок скорости ещё не было</b>",
+        "history": (
+            "📈 <b>История скорости, проверок: {count}</b>\n\n"
+            "<b>Последняя</b> (<code>{date}</code>, {server}):\n"
+            "{result}\n\n"
+            "<b>p5 / p50 / p95:</b>\n"
+            "<b>⬇️ <code>{download}</code> МБит/с</b>\n"
+            "<b>⬆️ <code>{upload}</code> МБит/с</b>\n"
+            "<b>🏓 <code>{ping}</code> мс</b>"
+        ),
+        "speed_chart": "Скорость, МБит/с",
+        "ping_chart": "Пинг, мс",
+        "download": "Скачать",
+        "upload": "Загрузить",
+        "progress_ping": "<b>🏓 Пинг: <code>{ping}</code> мс</b> ({server})",
+        "progress_download": "<b>⬇️ Скачать: <code>{progress}%</code>...</b>",
+        "progress_upload": "<b>⬆️ Загрузить: <code>{progress}%</code>...</b>",
+        "done_download": "<b>⬇️ Скачать: <code>{speed}</code> МБит/с</b>",
+        "done_upload": "<b>⬆️ Загрузить: <code>{speed}</code> МБит/с</b>",
+        "cancelled": "🚫 <b>Проверка скорости отменена</b>",
+        "timeout": "⏰ <b>Проверка скорости шла слишком долго и была остановлена</b>",
+        "failed": "🚫 <b>Не удалось проверить скорость:</b> <code>{error}</code>",
+        "cancelling": "🛑 <b>Отменяем проверку скорости...</b>",
+        "not_running": "🤷‍♀️ <b>Проверка скорости не запущена</b>",
+        "cfg_schedule_interval": "Проверять скорость в фоне каждые N минут, 0 — не проверять",
+        "cfg_history_file": "Файл, в котором хранятся результаты проверок",
+        "cfg_server_cache_ttl": "Сколько часов использовать выбранный сервер",
+        "cfg_pinned_server": "ID сервера speedtest.net, который использовать всегда, 0 — выбирать автоматически",
+        "cfg_threads": "Число параллельных соединений, 0 — как у speedtest.net",
+        "cfg_single_stream": "Использовать одно соединение, чтобы измерить его скорость",
+        "cfg_download_sizes": "Размеры картинок для скачивания, например [350, 1000], пусто — по умолчанию",
+        "cfg_upload_sizes": "Размеры загружаемых данных в байтах, пусто — по умолчанию",
+        "cfg_subprocess": "Проверять скорость в отдельном процессе, чтобы не тормозить юзербот",
+        "cfg_target_url": (
+            "Адрес загрузки своего сервера, совместимого с speedtest.net, "
+            "например http://10.0.0.2/speedtest/upload.php, пусто — speedtest.net"
+        ),
     }
 
-    async def client_ready(self, client: TelegramClient, _):
+    def __init__(self):
+        self.config = loader.ModuleConfig(
+            "SCHEDULE_INTERVAL",
+            0,
+            lambda m: self.strings("cfg_schedule_interval", m),
+            "HISTORY_FILE",
+            HISTORY_FILE,
+            lambda m: self.strings("cfg_history_file", m),
+            "SERVER_CACHE_TTL",
+            24,
+            lambda m: self.strings("cfg_server_cache_ttl", m),
+            "PINNED_SERVER",
+            0,
+            lambda m: self.strings("cfg_pinned_server", m),
+            "THREADS",
+            0,
+            lambda m: self.strings("cfg_threads", m),
+            "SINGLE_STREAM",
+            False,
+            lambda m: self.strings("cfg_single_stream", m),
+            "DOWNLOAD_SIZES",
+            [],
+            lambda m: self.strings("cfg_download_sizes", m),
+            "UPLOAD_SIZES",
+            [],
+            lambda m: self.strings("cfg_upload_sizes", m),
+            "TARGET_URL",
+            "",
+            lambda m: self.strings("cfg_target_url", m),
+            "SUBPROCESS",
+            False,
+            lambda m: self.strings("cfg_subprocess", m),
+        )
+        # speedtest saturates the link, so tests never run concurrently
+        self.lock = asyncio.Lock()
+        self.scheduler_task: Optional[asyncio.Task] = None
+        self.shutdown_event: Optional[threading.Event] = None
+        self.last_test = 0.0
+
+    async def client_ready(self, client: TelegramClient, db):
         """client_ready hook"""
+        self.client = client
+        self.db = db
         await client(JoinChannelRequest(channel=self.strings("author")))
 
+        self.scheduler_task = asyncio.ensure_future(self.scheduler())
+
+    def on_unload(self):
+        """on_unload hook"""
+        if self.scheduler_task:
+            self.scheduler_task.cancel()
+        if self.shutdown_event:
+            self.shutdown_event.set()
+
+    def get(self, key: str, default: Any = None):
+        """Get value from database"""
+        return self.db.get(self.strings("name"), key, default)
+
+    def set(self, key: str, value: Any):
+        """Set value in database"""
+        return self.db.set(self.strings("name"), key, value)
+
+    def get_history(self) -> History:
+        """Get results history from the configured file"""
+        return History(self.config["HISTORY_FILE"])
+
+    def get_settings(self, ping_only: bool = False) -> dict:
+        """Get `speedtest_worker` settings from config"""
+        return {
+            "servers": self.get("servers", {}),
+            "pinned_id": int(self.config["PINNED_SERVER"] or 0),
+            "ttl": self.config["SERVER_CACHE_TTL"] * 3600,
+            "ping_only": ping_only,
+            "threads": (
+                1 if self.config["SINGLE_STREAM"] else int(self.config["THREADS"] or 0)
+            ),
+            "download_sizes": self.config["DOWNLOAD_SIZES"] or [],
+            "upload_sizes": self.config["UPLOAD_SIZES"] or [],
+            "target": self.config["TARGET_URL"] or None,
+        }
+
+    async def run_worker(
+        self,
+        progress: Optional[Callable[[dict], Awaitable]] = None,
+        ping_only: bool = False,
+    ) -> dict:
+        """
+        Run `speedtest_worker` in a thread or, with SUBPROCESS, in a separate
+        process, passing its state to `progress` after each event.
+        Returns the final state.
+        Raises `asyncio.TimeoutError` if it takes over TEST_TIMEOUT
+        """
+        loop = asyncio.get_event_loop()
+        events = asyncio.Queue()
+        shutdown_event = threading.Event()
+
+        def emit(event: str, data: dict):
+            loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+        async with self.lock:
+            self.shutdown_event = shutdown_event
+            state = {}
+            process = None
+            try:
+                settings = self.get_settings(ping_only)
+                if self.config["SUBPROCESS"]:
+                    try:
+                        process = await self.start_process(
+                            settings, events, shutdown_event
+                        )
+                    except OSError:
+                        logger.warning(
+                            "Unable to start worker process, running in a thread",
+                            exc_info=True,
+                        )
+                if not process:
+                    loop.run_in_executor(
+                        None,
+                        functools.partial(
+                            speedtest_worker, emit, shutdown_event, settings
+                        ),
+                    )
+
+                deadline = loop.time() + TEST_TIMEOUT
+                while True:
+                    event, data = await asyncio.wait_for(
+                        events.get(), deadline - loop.time()
+                    )
+                    if event == "end":
+                        break
+                    if event == "error":
+                        # Worker stopped halfway may fail, it's still a cancel
+                        if shutdown_event.is_set():
+                            raise SpeedtestCancelled
+                        raise SpeedtestError(data["error"])
+                    if "servers" in data:
+                        self.set("servers", data.pop("servers"))
+
+                    state.update(data)
+                    if progress and not shutdown_event.is_set():
+                        await progress(state)
+            finally:
+                # Thread worker is left to stop on its own, it can't be killed,
+                # but the process is waited for, so tests never overlap
+                shutdown_event.set()
+                if process:
+                    await process
+                self.shutdown_event = None
+
+        return state
+
+    @staticmethod
+    async def start_process(
+        settings: dict,
+        events: asyncio.Queue,
+        shutdown_event: threading.Event,
+    ) -> asyncio.Future:
+        """
+        Start worker in a new interpreter, putting its events to
+        `events`. The process is terminated once `shutdown_event` is set.
+        Returns a task finishing when the process has exited
+        """
+        loop = asyncio.get_event_loop()
+        process = await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-c",
+            WORKER_SCRIPT,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        process.stdin.write(json.dumps(settings).encode() + b"\n")
+        process.stdin.close()
+
+        async def read():
+            # stderr is drained concurrently, so the worker never blocks on it
+            stderr = asyncio.ensure_future(process.stderr.read())
+            ended = False
+            async for line in process.stdout:
+                try:
+                    event, data = json.loads(line)
+                except ValueError:
+                    continue
+                ended = ended or event == "end"
+                events.put_nowait((event, data))
+
+            code = await process.wait()
+            error = (await stderr).decode(errors="ignore").strip()
+            if not ended:
+                events.put_nowait(
+                    (
+                        "error",
+                        {
+                            "error": (
+                                error.splitlines()[-1] if error else f"exit code {code}"
+                            )
+                        },
+                    )
+                )
+                events.put_nowait(("end", {}))
+
+        async def stop():
+            await loop.run_in_executor(None, shutdown_event.wait)
+            if process.returncode is None:
+                process.terminate()
+                try:
+                    await asyncio.wait_for(process.wait(), PROCESS_STOP_TIMEOUT)
+                except asyncio.TimeoutError:
+                    process.kill()
+
+            await reader
+
+        reader = asyncio.ensure_future(read())
+        return asyncio.ensure_future(stop())
+
+    async def run_test(
+        self, progress: Optional[Callable[[dict], Awaitable]] = None
+    ) -> Result:
+        """Run speedtest and save its result to history"""
+        state = await self.run_worker(progress)
+        if "upload" not in state:
+            raise SpeedtestCancelled
+
+        result = Result(
+            time.time(),
+            state["download"],
+            state["upload"],
+            state["ping"],
+            state["server"],
+        )
+        self.last_test = result.timestamp
+        await utils.run_sync(self.get_history().append, result)
+        return result
+
+    async def scheduler(self):
+        """Run speedtest every SCHEDULE_INTERVAL minutes, if it's set"""
+        results = await utils.run_sync(self.get_history().read)
+        if results:
+            self.last_test = max(self.last_test, results[-1].timestamp)
+
+        while True:
+            interval = max(self.config["SCHEDULE_INTERVAL"] or 0, 0) * 60
+            due_in = self.last_test + interval - time.time()
+            if not interval or due_in > 0:
+                await asyncio.sleep(
+                    min(due_in, SCHEDULER_TICK) if interval else SCHEDULER_TICK
+                )
+                continue
+
+            try:
+                await self.run_test()
+            except SpeedtestCancelled:
+                logger.info("Scheduled speedtest was cancelled")
+                self.last_test = time.time()
+            except Exception:  # pylint: disable=broad-except
+                logger.exception("Scheduled speedtest failed")
+                # Failed test waits for the next interval too, not retried in a loop
+                self.last_test = time.time()
+
+    def format_result(self, result: Result) -> str:
+        """Format result with `result` string"""
+        return self.strings("result").format(
+            download=round(result.download / 1024 / 1024),
+            upload=round(result.upload / 1024 / 1024),
+            ping=round(result.ping, 3),
+        )
+
+    def format_progress(self, state: dict) -> str:
+        """Format state of running speedtest"""
+        lines = [self.strings("running")]
+        if "ping" in state:
+            lines.append(
+                self.strings("progress_ping").format(
+                    ping=round(state["ping"], 3),
+                    server=utils.escape_html(state["server"]),
+                )
+            )
+
+        for stage in ("download", "upload"):
+            if stage in state:
+                lines.append(
+                    self.strings(f"done_{stage}").format(
+                        speed=round(state[stage] / 1024 / 1024)
+                    )
+                )
+            elif state.get("stage") == stage:
+                lines.append(
+                    self.strings(f"progress_{stage}").format(
+                        progress=round(state["progress"] * 100)
+                    )
+                )
+
+        return "\n".join(lines)
+
     async def speedtestcmd(self, message: Message):
-        """Run speedtest"""
+        """[ping] — Run speedtest, or only measure ping"""
+        ping_only = "ping" in utils.get_args(message)
         m = await utils.answer(message, self.strings("running"))
-        results = await utils.run_sync(self.run_speedtest)
-        await utils.answer(
-            m,
-            self.strings("result").format(
-                download=round(results[0] / 1024 / 1024),
-                upload=round(results[1] / 1024 / 1024),
-                ping=round(results[2], 3),
-            ),
+        if isinstance(m, list):
+            m = m[0]
+        last_edit = time.monotonic()
+
+        async def progress(state: dict):
+            nonlocal last_edit
+            if time.monotonic() - last_edit < EDIT_INTERVAL:
+                return
+
+            last_edit = time.monotonic()
+            with suppress(MessageNotModifiedError):
+                await utils.answer(m, self.format_progress(state))
+
+        try:
+            if ping_only:
+                state = await self.run_worker(ping_only=True)
+                text = self.strings("progress_ping").format(
+                    ping=round(state["ping"], 3),
+                    server=utils.escape_html(state["server"]),
+                )
+            else:
+                text = self.format_result(await self.run_test(progress))
+        except SpeedtestCancelled:
+            text = self.strings("cancelled")
+        except asyncio.TimeoutError:
+            text = self.strings("timeout")
+        except SpeedtestError as e:
+            text = self.strings("failed").format(error=utils.escape_html(str(e)))
+
+        await utils.answer(m, text)
+
+    async def speedtestcancelcmd(self, message: Message):
+        """Cancel running speedtest"""
+        if not self.shutdown_event:
+            return await utils.answer(message, self.strings("not_running"))
+
+        self.shutdown_event.set()
+        await utils.answer(message, self.strings("cancelling"))
+
+    async def speedhistorycmd(self, message: Message):
+        """[1h/1d/1w] — Show speedtest history for period"""
+        results = await utils.run_sync(self.get_history().read)
+        window = next(
+            (arg for arg in utils.get_args(message) if WINDOW_RE.match(arg)), None
         )
+        if window:
+            count, unit = WINDOW_RE.match(window).groups()
+            since = time.time() - int(count) * WINDOW_UNITS[unit]
+            results = [result for result in results if result.timestamp >= since]
 
-    @staticmethod
-    def run_speedtest() -> Tuple[float, float, float]:
-        """Speedtest using `speedtest` library"""
-        s = speedtest.Speedtest()  # pylint: disable=no-member
-        s.get_servers()
-        s.get_best_server()
-        s.download()
-        s.upload()
-        res = s.results.dict()
-        return res["download"], res["upload"], res["ping"]
+        if not results:
+            return await utils.answer(message, self.strings("no_history"))
+
+        def spread(values: List[float], scale: float = 1) -> str:
+            return " / ".join(
+                str(round(percentile(values, q) / scale, 1)) for q in (5, 50, 95)
+            )
+
+        latest = results[-1]
+        text = self.strings("history").format(
+            count=len(results),
+            date=datetime.fromtimestamp(latest.timestamp).strftime("%d.%m.%Y %H:%M"),
+            server=utils.escape_html(latest.server),
+            result=self.format_result(latest),
+            download=spread([result.download for result in results], 1024 * 1024),
+            upload=spread([result.upload for result in results], 1024 * 1024),
+            ping=spread([result.ping for result in results]),
+        )
+
+        if len(results) < 2:
+            return await utils.answer(message, text)
+
+        stream = await utils.run_sync(self.draw_history, results)
+        await self.client.send_file(
+            message.chat_id,
+            stream,
+            caption=text,
+            reply_to=message.reply_to_msg_id,
+        )
+        if message.out:
+            await message.delete()
+
+    def draw_history(self, results: List[Result]) -> BytesIO:
+        """Draw speed and ping trend charts of `results`"""
+        # matplotlib is imported on first use to keep module load cheap
+        # pylint: disable=import-outside-toplevel
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        from matplotlib.figure import Figure
+
+        figure = Figure(figsize=(8, 6))
+        FigureCanvasAgg(figure)
+        speed_ax, ping_ax = figure.subplots(2, sharex=True)
+        dates = [datetime.fromtimestamp(result.timestamp) for result in results]
+
+        speed_ax.set_title(self.strings("speed_chart"))
+        speed_ax.plot(
+            dates,
+            [result.download / 1024 / 1024 for result in results],
+            label=self.strings("download"),
+        )
+        speed_ax.plot(
+            dates,
+            [result.upload / 1024 / 1024 for result in results],
+            label=self.strings("upload"),
+        )
+        speed_ax.legend()
+
+        ping_ax.set_title(self.strings("ping_chart"))
+        ping_ax.plot(dates, [result.ping for result in results], "r")
+        ping_ax.tick_params(axis="x", labelrotation=30)
+
+        figure.tight_layout()
+        stream = BytesIO()
+        figure.savefig(stream, format="png")
+        stream.seek(0)
+        stream.name = "speedtest.png"
+        return stream
@@ -16,13 +16,18 @@
 
 # meta developer: @nalinormods
 
+import asyncio
+import bisect
+import json
 import logging
 import re
 import time
-from typing import Any, List
+from contextlib import suppress
+from typing import Any, Dict, List, Sequence, Set, Tuple
 
-from telethon import TelegramClient
-from telethon.hints import Entity
+from telethon import TelegramClient, events
+from telethon.errors import FloodWaitError, RPCError
+from telethon.hints import Entity, EntityLike
 from telethon.tl.custom import Message
 from telethon.tl.functions.channels import JoinChannelRequest
 from telethon.utils import get_peer_id
@@ -33,6 +38,33 @@ logger = logging.getLogger(__name__)
 
 USER_ID_RE = re.compile(r"^(-100)?\d+$")
 
+# Upper bounds of latency buckets, in seconds
+LATENCY_BUCKETS = (
+    0.00005,
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+)
+QUEUE_DEPTH_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+# How often stats summary is written to logs, in seconds
+REPORT_INTERVAL = 300
+# Flood waits longer than this are not waited out
+MAX_FLOOD_WAIT = 30
+# How long to collect album parts before deleting them in one request, in seconds
+ALBUM_DELAY = 1.0
+
 
 # pylint: disable=invalid-name
 def s2time(string) -> int:
@@ -77,6 +109,94 @@ def plural_number(n: int) -> str:
     )
 
 
+class Histogram:
+    """Fixed-bucket histogram of observed values"""
+
+    __slots__ = ("bounds", "counts", "count", "sum", "max")
+
+    def __init__(self, bounds: Sequence[float]):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)  # last one is overflow bucket
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        """Record a single value"""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, q: float) -> float:
+        """Estimate `q` percentile (0..1) as upper bound of the matching bucket"""
+        if not self.count:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        """Mean of observed values"""
+        return self.sum / self.count if self.count else 0.0
+
+    def as_dict(self) -> dict:
+        """Summary suitable for structured logging"""
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95),
+            "p99": self.percentile(0.99),
+            "max": self.max,
+        }
+
+
+class SwmuteMetrics:
+    """Counters and histograms describing swmute workload"""
+
+    COUNTERS = (
+        "inspected",
+        "matched",
+        "deletions_issued",
+        "deletions_failed",
+        "flood_waits",
+        "albums_batched",
+        "edits_matched",
+    )
+
+    def __init__(self):
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.watcher_latency = Histogram(LATENCY_BUCKETS)
+        self.deletion_latency = Histogram(LATENCY_BUCKETS)
+        self.queue_depth = Histogram(QUEUE_DEPTH_BUCKETS)
+        self.pending = 0
+        self.started = time.time()
+
+    def incr(self, name: str, n: int = 1):
+        """Increment counter `name` by `n`"""
+        self.counters[name] += n
+
+    def snapshot(self) -> dict:
+        """Return all metrics as a plain dict"""
+        return {
+            "uptime": round(time.time() - self.started),
+            **self.counters,
+            "pending_deletions": self.pending,
+            "watcher_latency": self.watcher_latency.as_dict(),
+            "deletion_latency": self.deletion_latency.as_dict(),
+            "queue_depth": self.queue_depth.as_dict(),
+        }
+
+
 # noinspection PyCallingNonCallable,PyAttributeOutsideInit
 # pylint: disable=not-callable,attribute-defined-outside-init,invalid-name
 @loader.tds
@@ -98,6 +218,24 @@ class SwmuteMod(loader.Module):
         "muted_users": "📃 <b>Swmuted users at the moment:</b>\n{names}",
         "cleared": "🧹 <b>Cleared mutes in this chat</b>",
         "cleared_all": "🧹 <b>Cleared all mutes</b>",
+        "catch_edits": "Also delete edited messages from muted users",
+        "stats": (
+            "📊 <b>Swmute stats for the last {uptime}</b>\n\n"
+            "👀 <b>Messages inspected:</b> <code>{inspected}</code>\n"
+            "🎯 <b>Messages matched:</b> <code>{matched}</code>\n"
+            "🗑 <b>Deletions issued:</b> <code>{deletions_issued}</code>\n"
+            "🚫 <b>Deletions failed:</b> <code>{deletions_failed}</code>\n"
+            "🌊 <b>Flood waits:</b> <code>{flood_waits}</code>\n"
+            "🖼 <b>Albums batched:</b> <code>{albums_batched}</code>\n"
+            "✏️ <b>Edits matched:</b> <code>{edits_matched}</code>\n"
+            "📥 <b>Pending deletions:</b> <code>{pending}</code>"
+            " (max <code>{max_depth}</code>)\n\n"
+            "⏱ <b>Watcher latency:</b> p50 <code>{w_p50}</code> ms,"
+            " p99 <code>{w_p99}</code> ms, max <code>{w_max}</code> ms\n"
+            "⏱ <b>Deletion latency:</b> p50 <code>{d_p50}</code> ms,"
+            " p99 <code>{d_p99}</code> ms, max <code>{d_max}</code> ms\n\n"
+            "🔇 <b>Active mutes:</b> <code>{mutes_total}</code>\n{mutes_per_chat}"
+        ),
         "s_one": "second",
         "s_few": "seconds",
         "s_many": "seconds",
@@ -120,6 +258,7 @@ class SwmuteMod(loader.Module):
         "_cmd_doc_swmuteclear": (
             "<all> — Удалить всех пользователей из списка swmute в этом/всех чатах"
         ),
+        "_cmd_doc_swmutestats": "Показать статистику работы swmute",
         "not_group": "🚫 <b>Эта команда предназначена только для групп</b>",
         "muted": "🔇 <b>{user} добавлен в список swmute на {time}</b>",
         "muted_forever": "🔇 <b>{user} добавлен в список swmute навсегда</b>",
@@ -132,6 +271,24 @@ class SwmuteMod(loader.Module):
         "muted_users": "📃 <b>Пользователи в списке swmute:</b>\n{names}",
         "cleared": "🧹 <b>Муты в этой группе очищены</b>",
         "cleared_all": "🧹 <b>Все муты очищены</b>",
+        "catch_edits": "Также удалять изменённые сообщения от замученных пользователей",
+        "stats": (
+            "📊 <b>Статистика swmute за последние {uptime}</b>\n\n"
+            "👀 <b>Сообщений проверено:</b> <code>{inspected}</code>\n"
+            "🎯 <b>Сообщений от замученных:</b> <code>{matched}</code>\n"
+            "🗑 <b>Запросов на удаление:</b> <code>{deletions_issued}</code>\n"
+            "🚫 <b>Неудачных удалений:</b> <code>{deletions_failed}</code>\n"
+            "🌊 <b>Флудвейтов:</b> <code>{flood_waits}</code>\n"
+            "🖼 <b>Альбомов удалено пачкой:</b> <code>{albums_batched}</code>\n"
+            "✏️ <b>Изменённых сообщений:</b> <code>{edits_matched}</code>\n"
+            "📥 <b>Ожидают удаления:</b> <code>{pending}</code>"
+            " (макс. <code>{max_depth}</code>)\n\n"
+            "⏱ <b>Задержка обработчика:</b> p50 <code>{w_p50}</code> мс,"
+            " p99 <code>{w_p99}</code> мс, макс. <code>{w_max}</code> мс\n"
+            "⏱ <b>Задержка удаления:</b> p50 <code>{d_p50}</code> мс,"
+            " p99 <code>{d_p99}</code> мс, макс. <code>{d_max}</code> мс\n\n"
+            "🔇 <b>Активных мутов:</b> <code>{mutes_total}</code>\n{mutes_per_chat}"
+        ),
         "s_one": "секунда",
         "s_few": "секунды",
         "s_many": "секунд",
@@ -146,15 +303,33 @@ class SwmuteMod(loader.Module):
         "d_many": "дней",
     }
 
+    def __init__(self):
+        self.config = loader.ModuleConfig(
+            "CATCH_EDITS", False, lambda m: self.strings("catch_edits", m)
+        )
+
     async def client_ready(self, client: TelegramClient, db):
         """client_ready hook"""
         self.client = client
         self.db = db
+        self.metrics = SwmuteMetrics()
+        self.next_report = time.time() + REPORT_INTERVAL
+        self.albums: Dict[Tuple[int, int], List[int]] = {}
+        self.album_tasks: Set[asyncio.Task] = set()
+        self.unloading = asyncio.Event()
+
+        client.add_event_handler(self.edit_watcher, events.MessageEdited())
 
         await client(JoinChannelRequest(channel=self.strings("author")))
 
         self.cleanup()
 
+    def on_unload(self):
+        """on_unload hook"""
+        self.client.remove_event_handler(self.edit_watcher, events.MessageEdited)
+        # Pending albums are deleted right away instead of being left behind
+        self.unloading.set()
+
     def get(self, key: str, default: Any = None):
         """Get value from database"""
         return self.db.get(self.strings("name"), key, default)
@@ -222,6 +397,20 @@ class SwmuteMod(loader.Module):
         """Get mute expiration timestamp"""
         return self.get("mutes", {}).get(str(chat_id), {}).get(str(user_id))
 
+    def count_mutes(self) -> Dict[str, int]:
+        """Get count of active mutes per chat"""
+        now = time.time()
+        return {
+            chat_id: count
+            for chat_id, chat_mutes in self.get("mutes", {}).items()
+            if (
+                count := sum(
+                    until_time == 0 or until_time > now
+                    for until_time in chat_mutes.values()
+                )
+            )
+        }
+
     def cleanup(self):
         """Cleanup expired mutes"""
         mutes = {}
@@ -358,18 +547,155 @@ class SwmuteMod(loader.Module):
             self.clear_mutes(message.chat_id)
             await utils.answer(message, self.strings("cleared"))
 
-    async def watcher(self, message: Message):
+    async def swmutestatscmd(self, message: Message):
+        """Show swmute workload statistics"""
+        stats = self.metrics.snapshot()
+        mutes = self.count_mutes()
+
+        def ms(value: float) -> str:
+            return f"{value * 1000:.3f}"
+
+        mutes_per_chat = "\n".join(
+            f"• <code>{chat_id}</code>: <code>{count}</code>"
+            for chat_id, count in sorted(
+                mutes.items(), key=lambda item: item[1], reverse=True
+            )[:10]
+        )
+
+        await utils.answer(
+            message,
+            self.strings("stats").format(
+                uptime=self.format_time(stats["uptime"], max_words=2) or "0",
+                inspected=stats["inspected"],
+                matched=stats["matched"],
+                deletions_issued=stats["deletions_issued"],
+                deletions_failed=stats["deletions_failed"],
+                flood_waits=stats["flood_waits"],
+                albums_batched=stats["albums_batched"],
+                edits_matched=stats["edits_matched"],
+                pending=stats["pending_deletions"],
+                max_depth=int(stats["queue_depth"]["max"]),
+                w_p50=ms(stats["watcher_latency"]["p50"]),
+                w_p99=ms(stats["watcher_latency"]["p99"]),
+                w_max=ms(stats["watcher_latency"]["max"]),
+                d_p50=ms(stats["deletion_latency"]["p50"]),
+                d_p99=ms(stats["deletion_latency"]["p99"]),
+                d_max=ms(stats["deletion_latency"]["max"]),
+                mutes_total=sum(mutes.values()),
+                mutes_per_chat=mutes_per_chat,
+            ),
+        )
+
+    def report(self):
+        """Write stats summary to logs if it's time to"""
+        now = time.time()
+        if now < self.next_report:
+            return
+
+        self.next_report = now + REPORT_INTERVAL
+        logger.info(
+            "swmute stats: %s",
+            json.dumps({**self.metrics.snapshot(), "active_mutes": self.count_mutes()}),
+        )
+
+    async def delete_messages(self, chat: EntityLike, ids: List[int]) -> bool:
+        """
+        Delete messages `ids` in `chat`, accounting it in metrics.
+        Returns whether they were deleted
+        """
+        metrics = self.metrics
+        metrics.pending += len(ids)
+        metrics.queue_depth.observe(metrics.pending)
+        started = time.perf_counter()
+
+        try:
+            for attempt in range(2):
+                metrics.incr("deletions_issued")
+                try:
+                    await self.client.delete_messages(chat, ids)
+                    return True
+                except FloodWaitError as e:
+                    metrics.incr("flood_waits")
+                    if attempt or e.seconds > MAX_FLOOD_WAIT:
+                        raise
+
+                    logger.debug("Waiting %ss before deleting messages", e.seconds)
+                    await asyncio.sleep(e.seconds)
+        except RPCError as e:
+            metrics.incr("deletions_failed")
+            logger.warning("Failed to delete messages %s in %s: %s", ids, chat, e)
+        finally:
+            metrics.pending -= len(ids)
+            metrics.deletion_latency.observe(time.perf_counter() - started)
+
+        return False
+
+    def queue_album_part(self, chat: EntityLike, message: Message):
+        """Collect album part to delete the whole album in one request"""
+        metrics = self.metrics
+        metrics.pending += 1
+        metrics.queue_depth.observe(metrics.pending)
+
+        key = (message.chat_id, message.grouped_id)
+        if key in self.albums:
+            self.albums[key].append(message.id)
+            return
+
+        self.albums[key] = [message.id]
+        task = asyncio.ensure_future(self.flush_album(chat, key))
+        self.album_tasks.add(task)
+        task.add_done_callback(self.album_done)
+
+    def album_done(self, task: asyncio.Task):
+        """Forget finished album task, logging its error if any"""
+        self.album_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error("Failed to delete album", exc_info=task.exception())
+
+    async def flush_album(self, chat: EntityLike, key: Tuple[int, int]):
+        """Delete collected album parts after `ALBUM_DELAY` or on unload"""
+        with suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self.unloading.wait(), ALBUM_DELAY)
+
+        ids = self.albums.pop(key)
+        self.metrics.pending -= len(ids)
+        self.metrics.incr("albums_batched")
+        if await self.delete_messages(chat, ids):
+            logger.debug("Deleted album %s in chat %s", ids, key[0])
+
+    async def edit_watcher(self, event: events.MessageEdited.Event):
+        """Handles edited messages"""
+        if self.config["CATCH_EDITS"]:
+            await self.watcher(event.message, edited=True)
+
+    async def watcher(self, message: Message, edited: bool = False):
         """Handles incoming messages"""
-        if (
-            isinstance(message, Message)
-            and not message.out
+        started = time.perf_counter()
+
+        if not isinstance(message, Message):
+            return
+
+        self.metrics.incr("inspected")
+        matched = (
+            not message.out
             and message.is_group
             and message.sender_id in self.get_mutes(message.chat_id)
-        ):
-            await message.delete()
+        )
+        self.metrics.watcher_latency.observe(time.perf_counter() - started)
+
+        if matched:
+            self.metrics.incr("matched")
+            if edited:
+                self.metrics.incr("edits_matched")
+
+            chat = await message.get_input_chat()
+            if message.grouped_id:
+                self.queue_album_part(chat, message)
+            elif await self.delete_messages(chat, [message.id]):
+                logger.debug(
+                    "Deleted message from user %s in chat %s",
+                    message.sender_id,
+                    message.chat_id,
+                )
 
-            logger.debug(
-                "Deleted message from user %s in chat %s",
-                message.sender_id,
-                message.chat_id,
-            )
+        self.report()